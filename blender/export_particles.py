@@ -1,91 +1,133 @@
-import bpy
+"""
+Export a particle representation of the animated scene.
+
+Surface points are sampled once per mesh in its local frame (and cached by
+mesh hash across traces), then moved along the recorded trajectories with
+NumPy. The result is written to <scenario_dir>/<trace>.particles.npz, with
+one (n_frames,n_points,3) array per mesh object (static objects have a
+single frame), and the 'times' of the rendered frames.
+
+Usage
+-----
+blender -b --python ... --python blender/export_particles.py -- \
+    scenario_dir trace
+
+"""
+import hashlib
 import os
+import pickle
 import sys
 
-print(sys.version)
-print()
-blend_dir = os.path.dirname(bpy.data.filepath)
-sys.path.append(os.path.join(os.getcwd(),'blender/python_blender_modules'))
-print('sys.path:', sys.path, '\n\n')
-
-
-# pytorch3d stuff to sample point from the blender meshes
-print("importing pytorch3d stuff...")
-from pytorch3d.io import load_obj, save_obj
-from pytorch3d.structures import Meshes
-from pytorch3d.utils import ico_sphere
-from pytorch3d.ops import sample_points_from_meshes
-print("imported pytorch3d!\n\n")
-
-# import other libraries
-import torch
+import bpy
 import numpy as np
 
-# visualization
-from mpl_toolkits.mplot3d import Axes3D
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-mpl.rcParams['savefig.dpi'] = 80
-mpl.rcParams['figure.dpi'] = 80
-
-# let's visulize some meshes!!!!!
-def plot_pointcloud(mesh, title=""):
-    # Sample points uniformly from the surface of the mesh.
-    points = sample_points_from_meshes(mesh, 1000)
-    x, y, z = points.clone().detach().cpu().squeeze().unbind(1)    
-    fig = plt.figure(figsize=(5, 5))
-    ax = Axes3D(fig)
-    ax.scatter3D(x, z, -y)
-    ax.set_xlabel('x')
-    ax.set_ylabel('z')
-    ax.set_zlabel('y')
-    ax.set_title(title)
-    ax.view_init(190, 30)
-    plt.savefig(title+'.png')
-
-
-### getting arguments after "--"
-import sys
-argv = sys.argv
-try:
-    index = argv.index("--") + 1
-except ValueError:
-    index = len(argv)
-argv = argv[index:]
-##############################
-
-scenario_dir = argv[0]
-trace = argv[1]
-
-
-meshes = {}
-# getting the meshes of the objects
-for ob in bpy.data.objects:
-    print(ob.name, "mesh", ob.data)
-    
-    if ob.type == 'MESH':
-        meshes[ob.name] = ob.data
-
-
-# data.polygons to get faces!! (somehow)
-# pytorch3d needs vertices and faces
-
-pt_meshes = {}
-for name in meshes:
-    # print(name)
-    mesh = meshes[name]
-
-    V = torch.empty(len(mesh.vertices), 3)
-    F = torch.empty(len(mesh.polygons), 3)
-
-    for i in range(len(mesh.vertices)):
-        # .co gets the vector
-        V[i,:] = torch.tensor(mesh.vertices[i].co)
-    
-    for i in range(len(mesh.polygons)):
-        F[i,:] = torch.tensor(mesh.polygons[i].vertices)
-    
-    pt_meshes[name] = Meshes(verts=[V], faces=[F])
-
-for name in pt_meshes:
-    plot_pointcloud(pt_meshes[name], name)
+sys.path.insert(0, os.getcwd())
+from core.trajectory import sample_states, states_to_matrices  # noqa: E402
+
+
+N_POINTS = 1000
+SEED = 0
+CACHE_DIR = os.path.join(".cache", "particles")
+
+
+def get_mesh_arrays(mesh):
+    """Return the (n,3) vertices and (m,3) triangles of a mesh in bulk."""
+    mesh.calc_loop_triangles()
+    verts = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get('co', verts)
+    tris = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int32)
+    mesh.loop_triangles.foreach_get('vertices', tris)
+    return verts.reshape(-1, 3), tris.reshape(-1, 3)
+
+
+def sample_surface(verts, tris, n, seed=SEED):
+    """Sample n points uniformly on the surface of a triangle mesh."""
+    rng = np.random.RandomState(seed)
+    a, b, c = (verts[tris[:, i]].astype(np.float64) for i in range(3))
+    areas = np.linalg.norm(np.cross(b - a, c - a), axis=1)
+    if not areas.sum():
+        return np.repeat(verts[:1], n, axis=0)
+    ind = rng.choice(len(tris), size=n, p=areas/areas.sum())
+    u, v = rng.random_sample((2, n, 1))
+    # Folding the unit square onto the triangle keeps the density uniform.
+    flip = (u + v) > 1
+    u = np.where(flip, 1 - u, u)
+    v = np.where(flip, 1 - v, v)
+    points = a[ind] + u * (b[ind] - a[ind]) + v * (c[ind] - a[ind])
+    return points.astype(np.float32)
+
+
+def get_point_cloud(mesh, n=N_POINTS):
+    """Return the local point cloud of a mesh, using the cache if possible."""
+    verts, tris = get_mesh_arrays(mesh)
+    h = hashlib.md5(verts.tobytes() + tris.tobytes())
+    h.update("{}-{}".format(n, SEED).encode())
+    path = os.path.join(CACHE_DIR, h.hexdigest() + ".npy")
+    try:
+        return np.load(path)
+    except FileNotFoundError:
+        points = sample_surface(verts, tris, n)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        np.save(path, points)
+        return points
+
+
+def get_animated_ancestor(ob, states):
+    while ob is not None and ob.name not in states:
+        ob = ob.parent
+    return ob
+
+
+def export_particles(states, filename):
+    scene = bpy.context.scene
+    render = scene.render
+    fps = render.fps / render.fps_base
+    frames = np.arange(scene.frame_start, scene.frame_end + 1)
+    times = (frames - scene.frame_start) / fps
+    particles = {}
+    for ob in scene.objects:
+        if ob.type != 'MESH':
+            continue
+        points = get_point_cloud(ob.data)
+        points = np.hstack((points, np.ones((len(points), 1), np.float32)))
+        anc = get_animated_ancestor(ob, states)
+        if anc is None:
+            mat = np.array(ob.matrix_world)
+            particles[ob.name] = points.dot(mat.T)[None, :, :3]
+            continue
+        # The mesh is rigidly attached to its animated ancestor, whose own
+        # parent is assumed static (e.g. a ball on a track).
+        rel = np.array(anc.matrix_world.inverted() @ ob.matrix_world)
+        if anc.parent is not None:
+            base = np.array(anc.parent.matrix_world
+                            @ anc.matrix_parent_inverse)
+        else:
+            base = np.eye(4)
+        anc_states = sample_states(states[anc.name], times)
+        mats = base @ states_to_matrices(anc_states) @ rel
+        particles[ob.name] = np.einsum(
+            'fij,pj->fpi', mats[:, :3], points).astype(np.float32)
+    np.savez_compressed(filename, times=times, **particles)
+    print("Exported {} point clouds over {} frames to {}".format(
+        len(particles), len(times), filename))
+
+
+def main():
+    # getting arguments after "--"
+    argv = sys.argv
+    try:
+        index = argv.index("--") + 1
+    except ValueError:
+        index = len(argv)
+    argv = argv[index:]
+
+    scenario_dir = argv[0]
+    trace = argv[1]
+
+    with open(os.path.join(scenario_dir, '{}.pkl'.format(trace)), 'rb') as f:
+        states = pickle.load(f)['states']
+    filename = os.path.join(scenario_dir, '{}.particles.npz'.format(trace))
+    export_particles(states, filename)
+
+
+main()
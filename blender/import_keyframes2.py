@@ -59,7 +59,8 @@ def import_states(path):
         o.rotation_mode = 'QUATERNION'
         for state in o_states:
             t, x, y, z, w, i, j, k, *_ = state
-            frame = int(t*fps) + 1
+            # Round, since resampled times are not exact multiples of 1/fps.
+            frame = int(round(t*fps)) + 1
             if has_scale:
                 sx, sy, sz = state[-3:]
             else:
@@ -83,9 +84,9 @@ def import_states(path):
     render = scene.render
     new_fps = render.fps
     print("Remapping {}FPS to {}FPS".format(fps, new_fps))
-    render.frame_map_old = fps
+    render.frame_map_old = int(fps)
     render.frame_map_new = new_fps
-    scene.frame_end = max_frame * new_fps // fps
+    scene.frame_end = int(max_frame * new_fps // fps)
 
 
 if __name__ == "__main__":
@@ -2,13 +2,72 @@
 Script to set up Cycles rendering. Sets the correct GPU without changing the
 blend file.
 
+If a scenario directory and a trace are given, each frame is streamed to
+ffmpeg as soon as it is rendered and the video is written to
+<scenario_dir>/<trace>.mp4 in a single pass (optionally prepended with a
+countdown). Otherwise frames are written to the render filepath. With
+--probes, the temporal probe variants of the stimulus are also generated
+from the rendered frames, without decoding the video.
+
 Usage
 -----
 blender -b path/to/file.blend -P path/to/render.py -- $NV_GPU
+blender -b path/to/file.blend -P path/to/render.py -- scenario_dir trace \
+    [--countdown path/to/countdown.mp4] [--probes]
 
 """
-import bpy
+import argparse
+import os
 import sys
+import tempfile
+
+import bpy
+
+sys.path.insert(0, os.getcwd())
+from core.video import (VideoEncoder, decode_images,  # noqa: E402
+                        write_temporal_probes)
+
+
+def stream_animation(scene, filename, countdown=None, probes=False):
+    """Render the animation and stream the frames to a single encoder.
+
+    If 'probes' is True, the temporal probes are written next to the video.
+
+    """
+    render = scene.render
+    scale = render.resolution_percentage / 100
+    size = (int(render.resolution_x * scale), int(render.resolution_y * scale))
+    fps = render.fps / render.fps_base
+    render.image_settings.file_format = 'PNG'
+    render.image_settings.color_mode = 'RGB'
+    # Frames only transit through a RAM-backed directory when available.
+    tmp_root = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    tmp_dir = tempfile.mkdtemp(dir=tmp_root)
+    render.filepath = os.path.join(tmp_dir, "")
+    encoder = VideoEncoder(filename, size, fps, countdown=countdown,
+                           pipe_format='png')
+    images = []
+
+    def write_frame(*args):
+        path = render.frame_path(frame=scene.frame_current)
+        with open(path, 'rb') as f:
+            data = f.read()
+        encoder.write_encoded(data)
+        if probes:
+            images.append(data)
+        os.remove(path)
+
+    bpy.app.handlers.render_write.append(write_frame)
+    try:
+        bpy.ops.render.render(animation=True)
+    finally:
+        bpy.app.handlers.render_write.remove(write_frame)
+        encoder.close()
+        os.rmdir(tmp_dir)
+    print("Encoded {} frames to {}".format(encoder.n_frames, filename))
+    if probes:
+        frames = decode_images(images, size)
+        write_temporal_probes(frames, fps, os.path.splitext(filename)[0])
 
 
 cycles_prefs = bpy.context.preferences.addons['cycles'].preferences
@@ -22,6 +81,19 @@ scene = bpy.data.scenes['Scene']
 #scene.cycles.device = 'GPU'
 scene.cycles.engine = 'CYCLES'
 scene.render.resolution_percentage = 100
-print("Rendering to {}".format(scene.render.filepath))
 
-bpy.ops.render.render(animation=True)
+argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+parser = argparse.ArgumentParser()
+parser.add_argument('scenario_dir', nargs='?')
+parser.add_argument('trace', nargs='?')
+parser.add_argument('--countdown', type=str, default=None)
+parser.add_argument('--probes', action='store_true')
+args, _ = parser.parse_known_args(argv)
+
+if args.trace is not None:
+    videofile = os.path.join(args.scenario_dir, '{}.mp4'.format(args.trace))
+    print("Rendering to {}".format(videofile))
+    stream_animation(scene, videofile, args.countdown, args.probes)
+else:
+    print("Rendering to {}".format(scene.render.filepath))
+    bpy.ops.render.render(animation=True)
@@ -0,0 +1,34 @@
+"""
+Save the current Blender scene to <scenario_dir>/<trace>.blend, so that it
+can be rendered in a separate process (see demos/campaign.py).
+
+Usage
+-----
+blender -b --python ... --python blender/save.py -- scenario_dir trace
+
+"""
+import os
+import sys
+
+import bpy
+
+
+def main():
+    # getting arguments after "--"
+    argv = sys.argv
+    try:
+        index = argv.index("--") + 1
+    except ValueError:
+        index = len(argv)
+    argv = argv[index:]
+
+    scenario_dir = argv[0]
+    trace = argv[1]
+
+    filepath = os.path.abspath(
+        os.path.join(scenario_dir, '{}.blend'.format(trace)))
+    bpy.ops.wm.save_as_mainfile(filepath=filepath)
+    print("Saved the scene to {}".format(filepath))
+
+
+main()
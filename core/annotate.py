@@ -0,0 +1,277 @@
+"""
+Per-frame 2D annotations of a trace, computed from its trajectories.
+
+Each object is approximated by a proxy (sphere or oriented box) derived from
+its primitive's parameters. Projected bounding boxes come from projecting
+the proxies with the stimulus camera, and visibility from casting rays from
+the camera to points sampled on each proxy and testing them against the
+other proxies, all vectorized over frames.
+
+Planes (floor, walls) are ignored, both as objects and as occluders.
+
+"""
+import math
+
+import numpy as np
+
+from . import config as cfg
+from . import primitives
+from .scenario import Scene, load_primitives, load_xforms
+from .trajectory import get_frame_times, get_world_matrices
+
+N_SURFACE_SAMPLES = 256
+N_SPHERE_HULL = 64
+SEED = 0
+
+
+class Camera:
+    """Pinhole model of a Blender camera.
+
+    Parameters
+    ----------
+    location : (3,) float sequence, optional
+      Location of the camera.
+    rotation : (3,) float sequence, optional
+      Blender 'XYZ' Euler angles of the camera, in radians.
+    lens : float, optional
+      Focal length in mm.
+    sensor_width : float, optional
+      Sensor size in mm, fitted to the largest dimension of the image.
+    resolution : (2,) int sequence, optional
+      Width and height of the image in pixels.
+
+    """
+    def __init__(self, location=cfg.CAMERA_LOCATION,
+                 rotation=cfg.CAMERA_ROTATION, lens=cfg.CAMERA_LENS,
+                 sensor_width=cfg.CAMERA_SENSOR_WIDTH,
+                 resolution=cfg.CAMERA_RESOLUTION):
+        self.location = np.asarray(location, dtype=np.float64)
+        rx, ry, rz = rotation
+        cx, sx = math.cos(rx), math.sin(rx)
+        cy, sy = math.cos(ry), math.sin(ry)
+        cz, sz = math.cos(rz), math.sin(rz)
+        Rx = np.array([[1, 0, 0], [0, cx, -sx], [0, sx, cx]])
+        Ry = np.array([[cy, 0, sy], [0, 1, 0], [-sy, 0, cy]])
+        Rz = np.array([[cz, -sz, 0], [sz, cz, 0], [0, 0, 1]])
+        # Camera to world rotation. The camera looks along its -Z axis.
+        self.rotation = Rz @ Ry @ Rx
+        self.resolution = tuple(resolution)
+        self.focal = lens / sensor_width * max(resolution)  # [px]
+
+    def project(self, points):
+        """Project (...,3) world points.
+
+        Returns
+        -------
+        pixels : (...,2) array
+          Image coordinates (origin at the top left corner, y down).
+        depth : (...) array
+          Distance along the viewing direction (negative behind the camera).
+
+        """
+        cam = (points - self.location) @ self.rotation
+        depth = -cam[..., 2]
+        w, h = self.resolution
+        with np.errstate(divide='ignore', invalid='ignore'):
+            u = w / 2 + self.focal * cam[..., 0] / depth
+            v = h / 2 - self.focal * cam[..., 1] / depth
+        return np.stack((u, v), axis=-1), depth
+
+
+class Proxy:
+    """Sphere or oriented box approximating an object, in its local frame.
+
+    Parameters
+    ----------
+    kind : {'sphere', 'box'}
+      Type of proxy.
+    center : (3,) float sequence
+      Center of the proxy.
+    size : float or (3,) float sequence
+      Radius of the sphere or half extents of the box.
+
+    """
+    def __init__(self, kind, center, size):
+        self.kind = kind
+        self.center = np.asarray(center, dtype=np.float64)
+        self.size = np.asarray(size, dtype=np.float64)
+
+    def get_hull(self):
+        """Return points whose projection bounds the projected proxy."""
+        if self.kind == 'sphere':
+            return self.center + self.size * fibonacci_sphere(N_SPHERE_HULL)
+        corners = np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1)
+                            for z in (-1, 1)], dtype=np.float64)
+        return self.center + corners * self.size
+
+    def sample_surface(self, n, seed=SEED):
+        """Return n points sampled on the surface and their normals."""
+        if self.kind == 'sphere':
+            normals = fibonacci_sphere(n)
+            return self.center + self.size * normals, normals
+        rng = np.random.RandomState(seed)
+        ext = self.size
+        areas = np.array([ext[1]*ext[2], ext[0]*ext[2], ext[0]*ext[1]])
+        axes = rng.choice(3, size=n, p=areas/areas.sum())
+        signs = rng.choice((-1., 1.), size=n)
+        points = rng.uniform(-1, 1, (n, 3))
+        points[np.arange(n), axes] = signs
+        normals = np.zeros((n, 3))
+        normals[np.arange(n), axes] = signs
+        return self.center + points * ext, normals
+
+    def intersect(self, origins, targets, eps=1e-6):
+        """Whether the segments from 'origins' to 'targets' (in the local
+        frame, broadcastable (...,3) arrays) cross the proxy.
+
+        """
+        d = targets - origins
+        o = origins - self.center
+        if self.kind == 'sphere':
+            a = np.einsum('...i,...i', d, d)
+            b = np.einsum('...i,...i', o, d)
+            c = np.einsum('...i,...i', o, o) - self.size**2
+            disc = b*b - a*c
+            sqrt_disc = np.sqrt(np.maximum(disc, 0))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                s0 = (-b - sqrt_disc) / a
+                s1 = (-b + sqrt_disc) / a
+            return (disc >= 0) & (s1 > eps) & (s0 < 1 - eps)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t1 = (-self.size - o) / d
+            t2 = (self.size - o) / d
+        t_min = np.nanmax(np.minimum(t1, t2), axis=-1)
+        t_max = np.nanmin(np.maximum(t1, t2), axis=-1)
+        return (t_max >= np.maximum(t_min, eps)) & (t_min < 1 - eps)
+
+
+def fibonacci_sphere(n):
+    """Return n nearly uniformly distributed unit vectors."""
+    i = np.arange(n) + .5
+    phi = np.arccos(1 - 2*i/n)
+    theta = math.pi * (1 + 5**.5) * i
+    return np.column_stack((np.cos(theta) * np.sin(phi),
+                            np.sin(theta) * np.sin(phi),
+                            np.cos(phi)))
+
+
+def get_proxy(prim):
+    """Return the Proxy of a primitive, or None if it is not supported."""
+    if isinstance(prim, primitives.Ball):
+        return Proxy('sphere', (0, 0, 0), prim.radius)
+    if isinstance(prim, primitives.Box):
+        return Proxy('box', (0, 0, 0), np.asarray(prim.extents) / 2)
+    if isinstance(prim, primitives.Track):
+        l, w, h, _ = prim.extents
+        return Proxy('box', (0, 0, 0), (l/2, w/2, h/2))
+    if isinstance(prim, primitives.Goblet):
+        h, r1, r2, eps = prim.extents
+        r = max(r1, r2) + eps
+        return Proxy('box', (0, 0, (h + eps) / 2), (r, r, (h + eps) / 2))
+    if isinstance(prim, primitives.Cylinder):
+        r, h = prim.extents[:2]
+        return Proxy('box', (0, 0, 0 if prim.center else h / 2),
+                     (r, r, h / 2))
+    return None
+
+
+def transform_points(mats, points):
+    """Apply (F,4,4) transforms to (K,3) or (F,K,3) points."""
+    subscripts = 'fij,kj->fki' if points.ndim == 2 else 'fij,fkj->fki'
+    return (np.einsum(subscripts, mats[:, :3, :3], points)
+            + mats[:, None, :3, 3])
+
+
+def annotate_trace(scenario_data, states, camera=None, fps=cfg.CAMERA_FPS,
+                   n_samples=N_SURFACE_SAMPLES):
+    """Compute the 2D annotations of every frame of a trace.
+
+    Parameters
+    ----------
+    scenario_data : dict
+      Scenario data of the trace.
+    states : dict
+      States recorded by a StateObserver.
+    camera : Camera, optional
+      Camera of the stimulus. Defaults to the camera of the renders.
+    fps : float, optional
+      Frame rate of the stimulus.
+    n_samples : int, optional
+      Number of points per object used to estimate visibility.
+
+    Returns
+    -------
+    annotations : dict
+      'names' (n,) of the objects, 'times' (F,) of the frames, 'boxes'
+      (F,n,4) as (xmin, ymin, xmax, ymax) pixels clipped to the image (NaN
+      when out of view), 'visibility' (F,n) fraction of the surface facing
+      the camera that is visible, 'occluded' (F,n) whether another object
+      hides part of the object and 'occluders' (F,n,n) whether object j
+      hides part of object i.
+
+    """
+    if camera is None:
+        camera = Camera()
+    scene_data = scenario_data['scene']
+    prim_graph = load_primitives(scene_data)
+    scene = Scene(geom=None, phys=False)
+    scene.populate(prim_graph, load_xforms(scene_data))
+    objects = []
+    for name, prim in prim_graph.nodes(data='prim'):
+        proxy = get_proxy(prim)
+        if proxy is None:
+            continue
+        path = scene.graph.find("**/" + name + "_solid")
+        if not path.is_empty():
+            objects.append((name, path, proxy))
+
+    times = get_frame_times(states, fps)
+    n_frames = len(times)
+    n_objects = len(objects)
+    w, h = camera.resolution
+
+    mats = [get_world_matrices(path, scene.graph, states, times)
+            for _, path, _ in objects]
+    inv_mats = [np.linalg.inv(m) for m in mats]
+
+    boxes = np.full((n_frames, n_objects, 4), np.nan, dtype=np.float32)
+    visibility = np.zeros((n_frames, n_objects), dtype=np.float32)
+    occluders = np.zeros((n_frames, n_objects, n_objects), dtype=bool)
+    for i, (_, _, proxy) in enumerate(objects):
+        # Projected bounding box.
+        pixels, depth = camera.project(transform_points(mats[i],
+                                                        proxy.get_hull()))
+        lo = np.clip(pixels.min(axis=1), 0, (w, h))
+        hi = np.clip(pixels.max(axis=1), 0, (w, h))
+        in_view = ((depth > 0).all(axis=1) & (hi > lo).all(axis=1))
+        boxes[in_view, i, :2] = lo[in_view]
+        boxes[in_view, i, 2:] = hi[in_view]
+        # Surface points facing the camera and inside the image.
+        points, normals = proxy.sample_surface(n_samples)
+        points = transform_points(mats[i], points)
+        normals = normals @ inv_mats[i][:, :3, :3]
+        facing = np.einsum('fki,fki->fk', normals,
+                           camera.location - points) > 0
+        pixels, depth = camera.project(points)
+        candidates = (facing & (depth > 0)
+                      & (pixels >= 0).all(axis=-1) & (pixels < (w, h)).all(axis=-1))
+        # Rays to the camera blocked by the other objects.
+        visible = candidates.copy()
+        for j, (_, _, other) in enumerate(objects):
+            if j == i:
+                continue
+            origins = transform_points(inv_mats[j], camera.location[None])
+            targets = transform_points(inv_mats[j], points)
+            blocked = candidates & other.intersect(origins, targets)
+            occluders[:, i, j] = blocked.any(axis=1)
+            visible &= ~blocked
+        with np.errstate(divide='ignore', invalid='ignore'):
+            visibility[:, i] = visible.sum(axis=1) / facing.sum(axis=1)
+    return {
+        'names': np.array([name for name, _, _ in objects]),
+        'times': times,
+        'boxes': boxes,
+        'visibility': visibility,
+        'occluded': occluders.any(axis=2),
+        'occluders': occluders,
+    }
@@ -23,6 +23,8 @@ class Event:
         self.outcome = AllAfter()
         self.state = EventState.asleep
         self.wake_time = 0
+        self.success_time = None
+        self.failure_time = None
 
     def __repr__(self):
         return self.name
@@ -30,6 +32,8 @@ class Event:
     def reset(self):
         self.state = EventState.asleep
         self.wake_time = 0
+        self.success_time = None
+        self.failure_time = None
 
     def update(self, time, verbose=False):
         if self.state is EventState.asleep:
@@ -41,12 +45,14 @@ class Event:
         if self.state is EventState.awake:
             if self.condition():
                 self.state = EventState.success
+                self.success_time = time
                 if verbose:
                     print("{} has happened.".format(self))
                 if self.outcome:
                     self.outcome(self.condition)
             elif time - self.wake_time > cfg.MAX_WAIT_TIME:
                 self.state = EventState.failure
+                self.failure_time = time
                 if verbose:
                     print("{} has not happened.".format(self))
 
@@ -157,6 +163,22 @@ class CausalGraphTraverser:
     def get_successful_events(self):
         return [e for e in self.get_events() if e.success]
 
+    def get_events_labels(self):
+        """Return a dict of event: label pairs, where label is True if the
+        event succeeded, False if it failed and None otherwise.
+
+        """
+        return {e.name: (True if e.success else False if e.failure else None)
+                for e in self.get_events()}
+
+    def get_events_times(self):
+        """Return a dict of event: (success_time, failure_time) pairs, where
+        each time is None if the event did not succeed (resp. fail).
+
+        """
+        return {e.name: (e.success_time, e.failure_time)
+                for e in self.get_events()}
+
     def reset(self):
         self.state = None
         self.last_wake_time = 0
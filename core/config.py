@@ -3,3 +3,19 @@ MAX_WAIT_TIME = 2        # [s]
 NCORES = 6
 SVC_C_RANGE = (-3, 3, 7)      # in logspace
 SVC_GAMMA_RANGE = (-3, 3, 7)  # in logspace
+SVC_SCORE_DROP_TOL = .01      # score drop that widens the warm-started search
+SGD_ALPHA_RANGE = (-6, -2, 5)  # in logspace
+RFF_N_COMPONENTS = 500        # random Fourier features of the RBF kernel
+APPROX_VALIDATION_FOLDS = 5   # 1 in 5 initial samples validates updates
+GEOMETRY_CACHE_DIR = ".cache/geometry"
+TRACEGEN_TIMESTEP = 1/120  # [s] low-fidelity simulation of candidate traces
+TRACEGEN_DURATION = 10     # [s]
+STIMULUS_INDEX = "stimuli.db"
+# Camera of the rendered stimuli (see blender/clean_up_scene.py), with
+# Blender's default lens, sensor and output settings.
+CAMERA_LOCATION = (0.17, 1.65, 0.20)      # [m]
+CAMERA_ROTATION = (1.5708, 0, 3.14159)    # [rad] XYZ Euler angles
+CAMERA_LENS = 50                          # [mm]
+CAMERA_SENSOR_WIDTH = 36                  # [mm]
+CAMERA_RESOLUTION = (1920, 1080)          # [px]
+CAMERA_FPS = 24
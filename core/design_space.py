@@ -36,6 +36,9 @@ class DesignSpace:
         ).reshape(len(ranges), 6)
         # Compute the test array of free parameters.
         self.is_free = np.isnan(self.xform_array)
+        # Compute the (object, component) index of each free parameter, in
+        # the order of the sample vector.
+        self.free_index = np.nonzero(self.is_free)
 
     def __len__(self):
         return self.origin_scale_array.shape[0]
@@ -52,19 +55,31 @@ class DesignSpace:
 
     def sample2xforms(self, sample):
         """Convert a sample to its transforms dict representation."""
-        sample = (np.asarray(sample) * self.origin_scale_array[:, 1]
-                  + self.origin_scale_array[:, 0])
-        xform_array = self.xform_array.copy()
-        xform_array[self.is_free] = sample
+        xform_array = self.samples2xform_array(np.asarray(sample)[None])[0]
         xforms = {name: xform for name, xform in zip(self.names, xform_array)}
         return xforms
 
     def xforms2sample(self, xforms):
         """Convert a transforms dict to it sample representation."""
         xform_array = np.array([xforms[name] for name in self.names])
-        sample = (xform_array[self.is_free] - self.origin_scale_array[:, 0]
-                  ) / self.origin_scale_array[:, 1]
-        return sample
+        return self.xform_array2samples(xform_array[None])[0]
+
+    def samples2xform_array(self, samples):
+        """Convert (n,ndims) samples to their (n,n_objects,6) transforms."""
+        samples = np.asarray(samples, dtype=np.float64)
+        xform_array = np.repeat(self.xform_array[None], len(samples), axis=0)
+        xform_array[(slice(None),) + self.free_index] = (
+            samples * self.origin_scale_array[:, 1]
+            + self.origin_scale_array[:, 0]
+        )
+        return xform_array
+
+    def xform_array2samples(self, xform_array):
+        """Convert (n,n_objects,6) transforms to their (n,ndims) samples."""
+        xform_array = np.asarray(xform_array, dtype=np.float64)
+        return ((xform_array[(slice(None),) + self.free_index]
+                 - self.origin_scale_array[:, 0])
+                / self.origin_scale_array[:, 1])
 
 
 def load_design_space(scene_data):
@@ -0,0 +1,257 @@
+"""
+Export of a scene graph and its recorded animation to binary glTF (.glb).
+
+The output can be loaded in one call by Blender's native glTF importer,
+animation included, which avoids going through .bam/.egg files and
+keyframing the states from Python.
+
+"""
+import json
+import math
+import struct
+
+import numpy as np
+from panda3d.core import Geom, GeomVertexFormat
+
+from .trajectory import insert_holds
+
+
+# glTF constants
+FLOAT = 5126
+UNSIGNED_INT = 5125
+ARRAY_BUFFER = 34962
+ELEMENT_ARRAY_BUFFER = 34963
+GLB_MAGIC = 0x46546C67
+GLB_JSON = 0x4E4F534A
+GLB_BIN = 0x004E4942
+# Panda3D is Z-up while glTF is Y-up: the root node rotates the scene by -90
+# degrees around X (quaternion in glTF's (x, y, z, w) order).
+Z_UP_TO_Y_UP = [-math.sqrt(.5), 0., 0., math.sqrt(.5)]
+
+
+class GLBWriter:
+    """Accumulates glTF objects and their binary data."""
+    def __init__(self):
+        self.data = bytearray()
+        self.gltf = {
+            'asset': {'version': "2.0",
+                      'generator': "physical_event_primitives"},
+            'scene': 0,
+            'scenes': [],
+            'nodes': [],
+            'meshes': [],
+            'animations': [],
+            'accessors': [],
+            'bufferViews': [],
+            'buffers': [],
+        }
+
+    def add_accessor(self, array, type_, target=None, bounds=False):
+        """Add an array to the binary buffer and return its accessor index.
+
+        Parameters
+        ----------
+        array : array_like
+          Array of float32 or uint32 values.
+        type_ : {'SCALAR', 'VEC3', 'VEC4'}
+          glTF type of each element.
+        target : int, optional
+          Buffer view target (ARRAY_BUFFER or ELEMENT_ARRAY_BUFFER).
+        bounds : bool, optional
+          Whether to store the min and max of the array (mandatory for
+          vertex positions and animation inputs).
+
+        """
+        array = np.ascontiguousarray(array)
+        offset = len(self.data)
+        self.data.extend(array.tobytes())
+        # Every buffer view is aligned on 4 bytes.
+        self.data.extend(b'\x00' * (-len(self.data) % 4))
+        view = {'buffer': 0, 'byteOffset': offset,
+                'byteLength': array.nbytes}
+        if target is not None:
+            view['target'] = target
+        self.gltf['bufferViews'].append(view)
+        accessor = {
+            'bufferView': len(self.gltf['bufferViews']) - 1,
+            'componentType': (UNSIGNED_INT if array.dtype == np.uint32
+                              else FLOAT),
+            'count': len(array),
+            'type': type_,
+        }
+        if bounds:
+            flat = array.reshape(len(array), -1)
+            accessor['min'] = flat.min(axis=0).tolist()
+            accessor['max'] = flat.max(axis=0).tolist()
+        self.gltf['accessors'].append(accessor)
+        return len(self.gltf['accessors']) - 1
+
+    def add_node(self, node):
+        self.gltf['nodes'].append(node)
+        return len(self.gltf['nodes']) - 1
+
+    def save(self, filename):
+        gltf = {k: v for k, v in self.gltf.items() if v != []}
+        gltf['buffers'] = [{'byteLength': len(self.data)}]
+        json_chunk = json.dumps(gltf, separators=(',', ':')).encode('utf-8')
+        json_chunk += b' ' * (-len(json_chunk) % 4)
+        bin_chunk = bytes(self.data)
+        length = 12 + 8 + len(json_chunk) + 8 + len(bin_chunk)
+        with open(filename, 'wb') as f:
+            f.write(struct.pack('<III', GLB_MAGIC, 2, length))
+            f.write(struct.pack('<II', len(json_chunk), GLB_JSON))
+            f.write(json_chunk)
+            f.write(struct.pack('<II', len(bin_chunk), GLB_BIN))
+            f.write(bin_chunk)
+
+
+def get_geom_arrays(geom):
+    """Return the float32 (n,3) positions, (n,3) normals and uint32 indices
+    of the triangles of a Geom.
+
+    """
+    vdata = geom.get_vertex_data().convert_to(GeomVertexFormat.get_v3n3())
+    raw = memoryview(vdata.get_array(0)).cast('B')
+    vertices = np.frombuffer(raw, np.float32).reshape(-1, 6)
+    indices = []
+    for prim in geom.get_primitives():
+        if prim.get_primitive_type() != Geom.PT_polygons:
+            continue
+        tris = prim.decompose().make_copy()
+        if not tris.is_indexed():
+            tris.make_indexed()
+        tris.set_index_type(Geom.NT_uint32)
+        raw = memoryview(tris.get_vertices()).cast('B')
+        indices.append(np.frombuffer(raw, np.uint32))
+    indices = np.concatenate(indices) if indices else np.empty(0, np.uint32)
+    return vertices[:, :3], vertices[:, 3:], indices
+
+
+def add_mesh(writer, geom_node):
+    """Add a mesh with one primitive per Geom and return its index."""
+    primitives = []
+    for geom in geom_node.get_geoms():
+        positions, normals, indices = get_geom_arrays(geom)
+        if not len(indices):
+            continue
+        attributes = {'POSITION': writer.add_accessor(
+            positions, 'VEC3', ARRAY_BUFFER, bounds=True)}
+        # Flat-shaded geometry only stores the normal of the last vertex of
+        # each triangle. In this case normals are left to the importer.
+        if np.linalg.norm(normals, axis=1).min() > .5:
+            attributes['NORMAL'] = writer.add_accessor(normals, 'VEC3',
+                                                       ARRAY_BUFFER)
+        primitives.append({
+            'attributes': attributes,
+            'indices': writer.add_accessor(indices, 'SCALAR',
+                                           ELEMENT_ARRAY_BUFFER),
+        })
+    if not primitives:
+        return None
+    writer.gltf['meshes'].append({'name': geom_node.name,
+                                  'primitives': primitives})
+    return len(writer.gltf['meshes']) - 1
+
+
+def add_subtree(writer, path, name2node):
+    """Recursively add a NodePath and its descendants as glTF nodes."""
+    node = {'name': path.get_name()}
+    xform = path.get_transform()
+    if not xform.is_identity():
+        x, y, z = xform.get_pos()
+        w, i, j, k = xform.get_quat()
+        node['translation'] = [x, y, z]
+        node['rotation'] = [i, j, k, w]
+        if xform.has_nonunity_scale():
+            node['scale'] = list(xform.get_scale())
+    if path.node().is_geom_node():
+        mesh = add_mesh(writer, path.node())
+        if mesh is not None:
+            node['mesh'] = mesh
+    children = [add_subtree(writer, child, name2node)
+                for child in path.get_children()]
+    if children:
+        node['children'] = children
+    index = writer.add_node(node)
+    name2node.setdefault(node['name'], index)
+    return index
+
+
+def get_keyframes(o_states, dt=None):
+    """Return the keyframes of an object's states as float32 arrays.
+
+    States are only recorded when the object moves: if dt (the simulation
+    timestep) is given, a key holding the previous state is inserted before
+    each gap so that linear interpolation does not smear the motion over the
+    time the object was static.
+
+    """
+    states = np.asarray(o_states, dtype=np.float64)
+    if dt is not None:
+        states = insert_holds(states, dt)
+    quats = states[:, 4:8]
+    # Keep consecutive quaternions in the same hemisphere so that
+    # interpolation takes the shortest path.
+    signs = np.sign(np.einsum('ij,ij->i', quats[1:], quats[:-1]))
+    signs = np.cumprod(np.concatenate(([1.], np.where(signs < 0, -1., 1.))))
+    quats = quats * signs[:, None]
+    times = states[:, 0].astype(np.float32)
+    translations = states[:, 1:4].astype(np.float32)
+    rotations = quats[:, [1, 2, 3, 0]].astype(np.float32)  # (x, y, z, w)
+    scales = states[:, 8:11].astype(np.float32) if states.shape[1] > 8 \
+        else None
+    return times, translations, rotations, scales
+
+
+def add_animation(writer, states, name2node, dt=None, name="simulation"):
+    """Add one animation with a channel per animated property."""
+    channels = []
+    samplers = []
+    for o_name, o_states in states.items():
+        if o_name not in name2node or not len(o_states):
+            continue
+        times, translations, rotations, scales = get_keyframes(o_states, dt)
+        input_ = writer.add_accessor(times, 'SCALAR', bounds=True)
+        outputs = [('translation', translations, 'VEC3'),
+                   ('rotation', rotations, 'VEC4')]
+        if scales is not None:
+            outputs.append(('scale', scales, 'VEC3'))
+        for path, values, type_ in outputs:
+            samplers.append({'input': input_,
+                             'output': writer.add_accessor(values, type_),
+                             'interpolation': 'LINEAR'})
+            channels.append({'sampler': len(samplers) - 1,
+                             'target': {'node': name2node[o_name],
+                                        'path': path}})
+    if channels:
+        writer.gltf['animations'].append(
+            {'name': name, 'channels': channels, 'samplers': samplers})
+
+
+def export_glb(root, filename, states=None, fps=None):
+    """Export a scene graph and its states to a .glb file.
+
+    Parameters
+    ----------
+    root : NodePath
+      Root of the scene graph.
+    filename : string
+      Output file.
+    states : dict, optional
+      Dictionary of o_name: o_states pairs, as recorded by a StateObserver.
+    fps : float, optional
+      Frequency at which the states were recorded.
+
+    """
+    writer = GLBWriter()
+    name2node = {}
+    children = [add_subtree(writer, child, name2node)
+                for child in root.get_children()]
+    scene_root = writer.add_node({'name': root.get_name(),
+                                  'rotation': Z_UP_TO_Y_UP,
+                                  'children': children})
+    writer.gltf['scenes'].append({'nodes': [scene_root]})
+    if states:
+        add_animation(writer, states, name2node,
+                      dt=(1 / fps if fps else None))
+    writer.save(filename)
@@ -0,0 +1,207 @@
+"""
+Index of the generated stimuli in a local SQLite database.
+
+Each trace of each scenario is recorded with its design parameters (the
+content of its Gen JSON file), physical validity, event labels and times,
+output files and their hashes, and the timing of each generation stage.
+
+Example
+-------
+>>> index = StimulusIndex("stimuli.db")
+>>> index.find_traces(event="ball_contained", label=True)
+[('containment_Gen', 3), ('containment_Gen', 8)]
+
+"""
+import json
+import sqlite3
+import time
+
+from . import config as cfg
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS traces (
+    scenario TEXT NOT NULL,
+    trace INTEGER NOT NULL,
+    params TEXT,
+    validity REAL,
+    success INTEGER,
+    PRIMARY KEY (scenario, trace)
+);
+CREATE TABLE IF NOT EXISTS events (
+    scenario TEXT NOT NULL,
+    trace INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    label INTEGER,
+    success_time REAL,
+    failure_time REAL,
+    PRIMARY KEY (scenario, trace, name)
+);
+CREATE TABLE IF NOT EXISTS files (
+    scenario TEXT NOT NULL,
+    trace INTEGER NOT NULL,
+    stage TEXT NOT NULL,
+    path TEXT NOT NULL,
+    hash TEXT,
+    PRIMARY KEY (scenario, trace, path)
+);
+CREATE TABLE IF NOT EXISTS timings (
+    scenario TEXT NOT NULL,
+    trace INTEGER NOT NULL,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL,
+    duration REAL,
+    time REAL
+);
+CREATE INDEX IF NOT EXISTS events_by_name ON events (name, label);
+"""
+
+
+class StimulusIndex:
+    """SQLite index of the generated traces.
+
+    Parameters
+    ----------
+    filename : string, optional
+      Path to the database, created if needed.
+
+    """
+    def __init__(self, filename=cfg.STIMULUS_INDEX):
+        self.filename = filename
+        # Calls from several threads must be serialized by the caller.
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.conn:
+            self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _ensure_trace(self, scenario, trace):
+        self.conn.execute(
+            "INSERT OR IGNORE INTO traces (scenario, trace) VALUES (?, ?)",
+            (scenario, trace)
+        )
+
+    def add_params(self, scenario, trace, params):
+        """Record the design parameters (JSON-serializable) of a trace."""
+        with self.conn:
+            self._ensure_trace(scenario, trace)
+            self.conn.execute(
+                "UPDATE traces SET params = ? WHERE scenario = ? AND trace = ?",
+                (json.dumps(params), scenario, trace)
+            )
+
+    def add_simulation(self, scenario, trace, validity=None, success=None,
+                       events=None):
+        """Record the outcome of the simulation of a trace.
+
+        Parameters
+        ----------
+        scenario : string
+          Name of the scenario.
+        trace : int
+          Trace number.
+        validity : float, optional
+          Physical validity constraint (see
+          Scene.get_physical_validity_constraint).
+        success : bool, optional
+          Global outcome of the causal graph.
+        events : dict, optional
+          Dictionary of name: label or name: (label, success_time,
+          failure_time) pairs, where label is in {True, False, None}.
+
+        """
+        with self.conn:
+            self._ensure_trace(scenario, trace)
+            self.conn.execute(
+                "UPDATE traces SET validity = ?, success = ? "
+                "WHERE scenario = ? AND trace = ?",
+                (None if validity is None else float(validity), success,
+                 scenario, trace)
+            )
+            if events:
+                rows = []
+                for name, value in events.items():
+                    if not isinstance(value, (tuple, list)):
+                        value = (value, None, None)
+                    rows.append((scenario, trace, name) + tuple(value))
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+
+    def add_files(self, scenario, trace, stage, files):
+        """Record the output files of a stage, as a path: hash dict."""
+        with self.conn:
+            self._ensure_trace(scenario, trace)
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                [(scenario, trace, stage, path, h)
+                 for path, h in files.items()]
+            )
+
+    def add_timing(self, scenario, trace, stage, status, duration):
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO timings VALUES (?, ?, ?, ?, ?, ?)",
+                (scenario, trace, stage, status, duration, time.time())
+            )
+
+    def query(self, sql, parameters=()):
+        """Run an SQL query and return all the rows."""
+        return self.conn.execute(sql, parameters).fetchall()
+
+    def find_traces(self, scenario=None, event=None, label=True,
+                    valid=None):
+        """Return the (scenario, trace) pairs matching the criteria.
+
+        Parameters
+        ----------
+        scenario : string, optional
+          Name of the scenario.
+        event : string, optional
+          Name of an event whose label must be 'label'.
+        label : {True, False, None}, optional
+          Label of the event.
+        valid : bool, optional
+          Whether the trace must be physically valid (or invalid).
+
+        """
+        sql = "SELECT t.scenario, t.trace FROM traces t"
+        where = []
+        parameters = []
+        if event is not None:
+            sql += (" JOIN events e ON e.scenario = t.scenario"
+                    " AND e.trace = t.trace")
+            where.append("e.name = ?")
+            parameters.append(event)
+            if label is None:
+                where.append("e.label IS NULL")
+            else:
+                where.append("e.label = ?")
+                parameters.append(int(label))
+        if scenario is not None:
+            where.append("t.scenario = ?")
+            parameters.append(scenario)
+        if valid is not None:
+            # Same threshold as Scene.check_physically_valid.
+            where.append("t.validity {} ?".format(">" if valid else "<="))
+            parameters.append(-1e-3)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY t.scenario, t.trace"
+        return self.query(sql, parameters)
+
+    def get_files(self, scenario, trace):
+        """Return the path: hash dict of the files of a trace."""
+        return dict(self.query(
+            "SELECT path, hash FROM files WHERE scenario = ? AND trace = ?",
+            (scenario, trace)
+        ))
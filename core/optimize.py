@@ -1,10 +1,17 @@
+import os
+import pickle
+
 import cma
 import numpy as np
 import scipy.optimize as opt
+from joblib import delayed, Parallel
 
-# from .config import NCORES
+from . import config as cfg
 from .robustness import compute_label
 
+# Default finite difference step of SciPy's SLSQP.
+FD_STEP = np.sqrt(np.finfo(float).eps)
+
 
 class RobustnessEnergy:
     def __init__(self, estimators, smin_coeff=1):
@@ -12,38 +19,159 @@ class RobustnessEnergy:
         self.smin_coeff = smin_coeff
 
     def __call__(self, x):
-        x = x.reshape(1, -1)
-        r = np.array([e.predict_proba(x)[0, 1] for e in self.estimators])
+        """Compute the energy of a (ndims,) point, or the (m,) energies of
+        (m,ndims) points.
+
+        """
+        x = np.asarray(x)
+        if x.ndim == 2:
+            return self.evaluate(x)
+        return self.evaluate(x.reshape(1, -1))[0]
+
+    def evaluate(self, X):
+        """Compute the energies of (m,ndims) points, with one prediction
+        per estimator.
+
+        """
+        r = np.column_stack([e.predict_proba(X)[:, 1]
+                             for e in self.estimators])
         exp = np.exp(-self.smin_coeff * r)
-        return -r.dot(exp) / exp.sum()
+        return -(r * exp).sum(axis=1) / exp.sum(axis=1)
+
+
+def evaluate_design_point(scenario, simu_kw, x):
+    """Evaluate a design point from a single scenario instance.
+
+    Returns
+    -------
+    res : dict
+      'validity' (physical validity constraint, <= 0), 'valid', and
+      'success' and 'events' (dict of event: label pairs), which are None if
+      the point is invalid.
+
+    """
+    instance = scenario.instantiate_from_sample(
+        x, geom=None, phys=True, verbose_causal_graph=False
+    )
+    C = instance.scene.get_physical_validity_constraint()
+    # Same threshold as Scene.check_physically_valid.
+    res = {'validity': min(C, 0.), 'valid': C > -1e-3,
+           'success': None, 'events': None}
+    if res['valid']:
+        res['success'] = instance.simulate(**simu_kw)
+        res['events'] = instance.embedded_causal_graph.get_events_labels()
+    return res
+
+
+class DesignPointEvaluator:
+    """Memoized evaluation of the design points of a scenario.
+
+    A single scenario instance is built per point, from which the physical
+    validity and, if valid, the success and events labels are computed.
+
+    """
+    def __init__(self, scenario, **simu_kw):
+        self.scenario = scenario
+        self.simu_kw = simu_kw
+        self.cache = {}
+
+    def evaluate(self, x):
+        """Evaluate a point (without memoization; see
+        evaluate_design_point).
+
+        """
+        return evaluate_design_point(self.scenario, self.simu_kw, x)
+
+    def evaluate_batch(self, X, parallel):
+        """Evaluate the points that are not memoized yet with a joblib
+        Parallel instance, and return the results for all points.
+
+        """
+        keys = [self._get_key(x) for x in X]
+        todo = {k: x for k, x in zip(keys, X) if k not in self.cache}
+        # Only the scenario is sent to the workers, not the cache.
+        results = parallel(
+            delayed(evaluate_design_point)(self.scenario, self.simu_kw, x)
+            for x in todo.values()
+        )
+        self.cache.update(zip(todo.keys(), results))
+        return [self.cache[k] for k in keys]
+
+    def clear(self):
+        self.cache.clear()
+
+    @staticmethod
+    def _get_key(x):
+        return np.asarray(x, dtype=np.float64).tobytes()
+
+    def __call__(self, x):
+        key = self._get_key(x)
+        try:
+            return self.cache[key]
+        except KeyError:
+            res = self.cache[key] = self.evaluate(x)
+            return res
 
 
 class CombinedEnergy:
     def __init__(self, estimators, scenario, smin_coeff=1, **simu_kw):
         self.robustness = RobustnessEnergy(estimators, smin_coeff)
-        self.phys_cs = PhysicalValidityConstraint(scenario)
-        self.succ_cs = SuccessConstraint(scenario, **simu_kw)
+        # Validity and success are computed from the same instance.
+        self.evaluator = DesignPointEvaluator(scenario, **simu_kw)
+        self.phys_cs = PhysicalValidityConstraint(scenario, self.evaluator)
+        self.succ_cs = SuccessConstraint(scenario, self.evaluator, **simu_kw)
 
     def __call__(self, x):
+        """Compute the energy of a (ndims,) point, or the (m,) energies of
+        (m,ndims) points (with a single robustness prediction).
+
+        """
+        x = np.asarray(x)
+        if x.ndim == 2:
+            energies = np.array([self._get_penalty(xi) for xi in x])
+            ok = np.isnan(energies)
+            if ok.any():
+                energies[ok] = self.robustness(x[ok])
+            return energies
+        penalty = self._get_penalty(x)
+        return self.robustness(x) if np.isnan(penalty) else penalty
+
+    def _get_penalty(self, x):
+        """Return the penalty of an invalid or unsuccessful point, NaN
+        otherwise.
+
+        """
         phys = self.phys_cs(x)
         if phys < 0:
             return 100 * -phys
         elif self.succ_cs(x) < 0:
             return 100
         else:
-            return self.robustness(x)
+            return np.nan
 
 
 class PhysicalValidityConstraint:
-    def __init__(self, scenario):
+    def __init__(self, scenario, evaluator=None):
         self.scenario = scenario
+        self.evaluator = evaluator
 
     def __call__(self, x):
+        if self.evaluator is not None:
+            return self.evaluator(x)['validity']
         C = self.scenario.instantiate_from_sample(
             x, geom=None, phys=True, verbose_causal_graph=False
         ).scene.get_physical_validity_constraint()
         return min(C, 0.)
 
+    def evaluate(self, X, parallel=None):
+        """Compute the constraint of (m,ndims) points, in parallel if a
+        joblib Parallel instance is given.
+
+        """
+        if parallel is None:
+            return np.array([self(x) for x in X])
+        return np.array(parallel(delayed(self)(x) for x in X))
+
 
 class PhysicalValidityConstraintBoolean:
     def __init__(self, scenario):
@@ -54,11 +182,15 @@ class PhysicalValidityConstraintBoolean:
 
 
 class SuccessConstraint:
-    def __init__(self, scenario, **simu_kw):
+    def __init__(self, scenario, evaluator=None, **simu_kw):
         self.scenario = scenario
+        self.evaluator = evaluator
         self.simu_kw = simu_kw
 
     def __call__(self, x):
+        if self.evaluator is not None:
+            res = self.evaluator(x)
+            return res['success'] - 1. if res['valid'] else 0.
         if self.scenario.check_physically_valid_sample(x):
             # _, labels = compute_label(
             #     self.scenario, x, ret_events_labels=True, **self.simu_kw
@@ -69,14 +201,44 @@ class SuccessConstraint:
             return 0.
 
 
-def maximize_robustness_local(scenario, estimators, x0, smin_coeff=1):
+def approx_jacobian(fun, x, step=FD_STEP):
+    """Approximate the gradient of a scalar function by forward differences.
+
+    Parameters
+    ----------
+    fun : callable
+      Vectorized function, mapping (m,ndims) points to (m,) values.
+    x : (ndims,) array_like
+      Point in [0, 1]^ndims, where the gradient is computed.
+    step : float, optional
+      Finite difference step. It is reversed in the dimensions where it
+      would leave [0, 1].
+
+    """
+    x = np.asarray(x, dtype=np.float64)
+    h = np.full(x.size, step)
+    h[x + h > 1] *= -1
+    f = fun(np.vstack((x, x + np.diag(h))))
+    return (f[1:] - f[0]) / h
+
+
+def maximize_robustness_local(scenario, estimators, x0, smin_coeff=1,
+                              n_jobs=cfg.NCORES):
     energy = RobustnessEnergy(estimators, smin_coeff)
-    phys_cs = dict(type='ineq', fun=PhysicalValidityConstraint(scenario))
+    phys_fun = PhysicalValidityConstraint(scenario)
     ndims = len(scenario.design_space)
     bounds = [(0, 1)] * ndims
-    res = opt.minimize(energy, x0, method='SLSQP',
-                       bounds=bounds, constraints=(phys_cs,),
-                       options=dict(disp=True))
+    with Parallel(n_jobs=n_jobs) as parallel:
+        # All the perturbed points of a gradient are evaluated at once.
+        def phys_jac(x):
+            return approx_jacobian(
+                lambda X: phys_fun.evaluate(X, parallel), x
+            )
+        phys_cs = dict(type='ineq', fun=phys_fun, jac=phys_jac)
+        res = opt.minimize(energy, x0, method='SLSQP',
+                           jac=lambda x: approx_jacobian(energy.evaluate, x),
+                           bounds=bounds, constraints=(phys_cs,),
+                           options=dict(disp=True))
     return res
 
 
@@ -90,12 +252,76 @@ def maximize_robustness_local(scenario, estimators, x0, smin_coeff=1):
 #     return res
 
 
+def _ask_feasible(es, evaluator, parallel, max_resamples=10):
+    """Ask CMA-ES for a population, resampling the physically invalid
+    candidates (at most max_resamples times).
+
+    All candidates are evaluated (and memoized) by the DesignPointEvaluator
+    in the process.
+
+    """
+    X = es.ask()
+    todo = np.arange(len(X))
+    for n_resamples in range(max_resamples + 1):
+        res = evaluator.evaluate_batch([X[i] for i in todo], parallel)
+        todo = todo[[not r['valid'] for r in res]]
+        if not todo.size or n_resamples == max_resamples:
+            break
+        for i, x in zip(todo, es.ask(len(todo))):
+            X[i] = x
+    return X
+
+
 def maximize_robustness_global(scenario, estimators, x0, smin_coeff=1,
-                               fevals=np.inf, **simu_kw):
+                               fevals=np.inf, n_jobs=cfg.NCORES,
+                               checkpoint=None, **simu_kw):
+    """Maximize the robustness of a scenario with CMA-ES.
+
+    Each population is prefiltered by physical validity and evaluated in
+    parallel, building a single scenario instance per candidate.
+
+    Parameters
+    ----------
+    scenario : scenario.Scenario
+      Abstract scenario.
+    estimators : sequence
+      Robustness estimators (see RobustnessEnergy).
+    x0 : (ndims,) array_like
+      Initial solution.
+    smin_coeff : float, optional
+      Coefficient of the soft minimum of the robustness estimates.
+    fevals : int, optional
+      Maximum number of evaluations.
+    n_jobs : int, optional
+      Number of workers.
+    checkpoint : string, optional
+      Path of a file where the state of the optimizer is saved after each
+      iteration. If it exists, the optimization resumes from it.
+
+    Returns
+    -------
+    res : cma.evolution_strategy.CMAEvolutionStrategyResult
+      Result of the optimization (best solution in res.xbest).
+
+    """
     energy = CombinedEnergy(estimators, scenario, smin_coeff, **simu_kw)
     # energy = RobustnessEnergy(estimators, smin_coeff)
-    phys_cs = PhysicalValidityConstraintBoolean(scenario)
-    options = {'bounds': [0, 1], 'is_feasible': phys_cs, 'maxfevals': fevals}
-    sigma0 = .25
-    res = cma.fmin(energy, x0, sigma0, options=options)
-    return res
+    if checkpoint is not None and os.path.isfile(checkpoint):
+        with open(checkpoint, 'rb') as f:
+            es = pickle.load(f)
+    else:
+        options = {'bounds': [0, 1], 'maxfevals': fevals}
+        sigma0 = .25
+        es = cma.CMAEvolutionStrategy(x0, sigma0, options)
+    with Parallel(n_jobs=n_jobs) as parallel:
+        while not es.stop():
+            X = _ask_feasible(es, energy.evaluator, parallel)
+            # The energy only reads the memoized evaluations.
+            es.tell(X, list(energy(np.asarray(X))))
+            es.disp()
+            if checkpoint is not None:
+                tmp = checkpoint + ".tmp"
+                with open(tmp, 'wb') as f:
+                    pickle.dump(es, f)
+                os.replace(tmp, checkpoint)
+    return es.result
@@ -1,9 +1,12 @@
+import copy
+
 import numpy as np
-import sobol_seq
 from joblib import delayed, Parallel
 from sklearn.feature_selection import mutual_info_classif
-from sklearn.model_selection import GridSearchCV
-from sklearn.pipeline import make_pipeline
+from sklearn.kernel_approximation import RBFSampler
+from sklearn.linear_model import SGDClassifier
+from sklearn.model_selection import GridSearchCV, PredefinedSplit
+from sklearn.pipeline import make_pipeline, Pipeline
 from sklearn.preprocessing import FunctionTransformer, StandardScaler
 from sklearn.svm import SVC
 from tqdm import tqdm
@@ -21,30 +24,192 @@ class MultivariateUniform:
         return (self.b - self.a) * np.random.sample((n, self.ndims)) + self.a
 
 
+def _get_normal_factor(cov):
+    """Return the (ndims,) standard deviations of a diagonal covariance, or
+    a (ndims,ndims) matrix L such that cov = L.L^T otherwise.
+
+    cov can also be given as the (ndims,) variances of a diagonal covariance.
+
+    """
+    cov = np.asarray(cov, dtype=np.float64)
+    if cov.ndim == 1:
+        return np.sqrt(cov)
+    diag = np.diag(cov)
+    if np.count_nonzero(cov - np.diag(diag)) == 0:
+        return np.sqrt(diag)
+    try:
+        return np.linalg.cholesky(cov)
+    except np.linalg.LinAlgError:
+        # Positive semi-definite.
+        w, v = np.linalg.eigh(cov)
+        return v * np.sqrt(np.clip(w, 0, None))
+
+
 class MultivariateMixtureOfGaussians:
+    """Mixture of multivariate normal distributions, clipped to [a, b].
+
+    Parameters
+    ----------
+    mixture_params : sequence
+      Sequence of (mean, cov) pairs, where cov is either a (ndims,ndims)
+      covariance matrix or the (ndims,) variances of a diagonal one.
+    weights : (n_components,) array_like, optional
+      Weight of each component (uniform by default).
+    a, b : float or (ndims,) array_like, optional
+      Bounds of the samples.
+
+    """
     def __init__(self, mixture_params, weights=None, a=0., b=1.):
         self.mixture_params = mixture_params
         self.weights = weights
         self.a = a
         self.b = b
+        # Factorize each covariance once.
+        self.means = np.array([mp[0] for mp in mixture_params],
+                              dtype=np.float64)
+        self.factors = [_get_normal_factor(mp[1]) for mp in mixture_params]
+        if all(f.ndim == 1 for f in self.factors):
+            self.stds = np.array(self.factors)
+        else:
+            self.stds = None
 
     def sample(self, n):
-        mps = self.mixture_params
-        choice = np.random.choice(len(mps), size=n, replace=True,
+        choice = np.random.choice(len(self.means), size=n, replace=True,
                                   p=self.weights)
-        normal = np.random.multivariate_normal
-        X = np.array([normal(mps[i][0], mps[i][1]) for i in choice])
+        Z = np.random.standard_normal((n, self.means.shape[1]))
+        if self.stds is not None:
+            X = self.means[choice] + self.stds[choice] * Z
+        else:
+            # Draw the samples of each component in bulk.
+            X = self.means[choice]
+            order = np.argsort(choice, kind='mergesort')
+            bounds = np.cumsum(np.bincount(choice,
+                                           minlength=len(self.means)))
+            start = 0
+            for factor, stop in zip(self.factors, bounds):
+                ind = order[start:stop]
+                if factor.ndim == 1:
+                    X[ind] += Z[ind] * factor
+                else:
+                    X[ind] += Z[ind] @ factor.T
+                start = stop
         return np.clip(X, self.a, self.b)
 
 
+# Primitive polynomials and initial direction numbers of the Sobol sequence
+# for each dimension (Bratley and Fox, 1988, as in sobol_seq).
+SOBOL_BITS = 30
+SOBOL_DIRECTIONS = (
+    (1, ()), (3, (1,)), (7, (1, 1)), (11, (1, 3, 7)), (13, (1, 1, 5)),
+    (19, (1, 3, 1, 1)), (25, (1, 1, 3, 7)), (37, (1, 3, 3, 9, 9)),
+    (59, (1, 3, 7, 13, 3)), (47, (1, 1, 5, 11, 27)),
+    (61, (1, 3, 5, 1, 15)), (55, (1, 1, 7, 3, 29)),
+    (41, (1, 3, 7, 7, 21)), (67, (1, 1, 1, 9, 23, 37)),
+    (97, (1, 3, 3, 5, 19, 33)), (91, (1, 1, 3, 13, 11, 7)),
+    (109, (1, 1, 7, 13, 25, 5)), (103, (1, 3, 5, 11, 7, 11)),
+    (115, (1, 1, 1, 3, 13, 39)), (131, (1, 3, 1, 15, 17, 63, 13)),
+    (193, (1, 1, 5, 5, 1, 27, 33)), (137, (1, 3, 3, 3, 25, 17, 115)),
+    (145, (1, 1, 3, 15, 29, 15, 41)), (143, (1, 3, 1, 7, 3, 23, 79)),
+    (241, (1, 3, 7, 9, 31, 29, 17)), (157, (1, 1, 5, 13, 11, 3, 29)),
+    (185, (1, 3, 1, 9, 5, 21, 119)), (167, (1, 1, 3, 1, 23, 13, 75)),
+    (229, (1, 3, 3, 11, 27, 31, 73)), (171, (1, 1, 7, 7, 19, 25, 105)),
+    (213, (1, 3, 5, 5, 21, 9, 7)), (191, (1, 1, 1, 15, 5, 49, 59)),
+    (253, (1, 1, 1, 1, 1, 33, 65)), (203, (1, 3, 5, 15, 17, 19, 21)),
+    (211, (1, 1, 7, 11, 13, 29, 3)), (239, (1, 3, 7, 5, 7, 11, 113)),
+    (247, (1, 1, 5, 3, 15, 19, 61)), (285, (1, 3, 1, 1, 9, 27, 89, 7)),
+    (369, (1, 1, 3, 7, 31, 15, 45, 23)),
+    (299, (1, 3, 3, 9, 9, 25, 107, 39)),
+)
+
+
+def get_sobol_directions(ndims):
+    """Return the (ndims,SOBOL_BITS) direction integers of the Sobol
+    sequence, as fractions of 2**SOBOL_BITS.
+
+    """
+    if not 1 <= ndims <= len(SOBOL_DIRECTIONS):
+        raise ValueError("The Sobol sequence is only defined for 1 to {} "
+                         "dimensions".format(len(SOBOL_DIRECTIONS)))
+    V = np.ones((ndims, SOBOL_BITS), dtype=np.int64)
+    for i in range(1, ndims):
+        poly, init = SOBOL_DIRECTIONS[i]
+        m = len(init)
+        v = list(init)
+        for j in range(m, SOBOL_BITS):
+            new = v[j-m]
+            for k in range(1, m+1):
+                if (poly >> (m-k)) & 1:
+                    new ^= v[j-k] << k
+            v.append(new)
+        V[i] = v
+    return V << np.arange(SOBOL_BITS-1, -1, -1)
+
+
 class SobolSequence:
-    def __init__(self, ndims, a=0., b=1.):
+    """Sobol low-discrepancy sequence in [a, b]^ndims.
+
+    The sequence is stateful: each call to sample continues where the
+    previous one stopped, so that successive batches cover new points. As in
+    sobol_seq, the first point (the origin) is skipped.
+
+    Parameters
+    ----------
+    ndims : int
+      Number of dimensions (at most len(SOBOL_DIRECTIONS)).
+    a, b : float or (ndims,) array_like, optional
+      Bounds of the domain.
+    skip : int, optional
+      Number of initial points to skip.
+    scramble : bool, optional
+      Whether to apply a random digital shift to the sequence, which
+      preserves its uniformity properties.
+    seed : int, optional
+      Seed of the scrambling.
+
+    """
+    def __init__(self, ndims, a=0., b=1., skip=0, scramble=False,
+                 seed=None):
         self.ndims = ndims
         self.a = a
         self.b = b
+        self.directions = get_sobol_directions(ndims)
+        if scramble:
+            rng = np.random.RandomState(seed)
+            self.shift = rng.randint(0, 2**SOBOL_BITS, ndims, dtype=np.int64)
+        else:
+            self.shift = np.zeros(ndims, dtype=np.int64)
+        self.reset()
+        self.fast_forward(skip)
+
+    def reset(self):
+        """Restart the sequence from its first point."""
+        self.index = 1
+
+    def fast_forward(self, n):
+        """Skip the next n points."""
+        self.index += n
+
+    def _get_point(self, index):
+        """Return the integer coordinates of the point at this index."""
+        gray = index ^ (index >> 1)
+        bits = (gray >> np.arange(SOBOL_BITS)) & 1
+        return np.bitwise_xor.reduce(self.directions[:, bits == 1], axis=1)
 
     def sample(self, n):
-        X = sobol_seq.i4_sobol_generate(self.ndims, n)
+        if self.index + n > 2**SOBOL_BITS:
+            raise ValueError("The Sobol sequence is limited to 2**{} "
+                             "points".format(SOBOL_BITS))
+        if n <= 0:
+            return np.empty((0, self.ndims))
+        # In Gray code order, each point differs from the previous one by the
+        # direction of the lowest zero bit of the previous index.
+        ind = np.arange(self.index + 1, self.index + n, dtype=np.int64)
+        cols = np.log2(ind & -ind).astype(int)
+        steps = np.vstack((self._get_point(self.index),
+                           self.directions[:, cols].T))
+        Q = np.bitwise_xor.accumulate(steps, axis=0) ^ self.shift
+        self.index += n
+        X = Q / 2**SOBOL_BITS
         return (self.b - self.a) * X + self.a
 
 
@@ -80,25 +245,112 @@ def find_physically_valid_samples(scenario, distribution, n_valid, max_trials):
     return samples
 
 
-def compute_label(scenario, sample, ret_events_labels=False, **simu_kw):
+def _check_physically_valid_samples(scenario, samples):
+    return [scenario.check_physically_valid_sample(s) for s in samples]
+
+
+def stream_physically_valid_samples(scenario, distribution, n_valid,
+                                    max_trials, n_jobs=cfg.NCORES,
+                                    chunk_size=None, verbose=False):
+    """Find physically valid samples for this scenario, in parallel.
+
+    Candidates are drawn from the distribution in chunks, and each chunk is
+    split across the workers. No more chunks are drawn once n_valid samples
+    are accepted, and the size of the next chunk is adapted to the running
+    acceptance rate. As in find_physically_valid_samples, the valid samples
+    are the first ones in the order in which they were drawn.
+
+    Parameters
+    ----------
+    scenario : scenario.Scenario
+      Abstract scenario.
+    distribution : {MultivariateUniform, MultivariateMixtureOfGaussians,
+                    SobolSequence}
+      Instance of the distribution to use for sampling.
+    n_valid : int
+      Number of expected valid samples.
+    max_trials : int
+      Maximum number of samples to try.
+    n_jobs : int, optional
+      Number of workers.
+    chunk_size : int, optional
+      Size of the first chunk (by default, n_valid rounded up to a multiple
+      of n_jobs).
+    verbose : bool, optional
+      Whether to print the acceptance rate after each chunk.
+
+    Returns
+    -------
+    samples : sequence
+      Physically valid samples. Size = (n,ndims), with n <= n_valid.
+
+    """
+    if chunk_size is None:
+        chunk_size = -(-n_valid // n_jobs) * n_jobs
+    samples = []
+    n_trials = 0
+    with Parallel(n_jobs=n_jobs) as parallel:
+        while len(samples) < n_valid and n_trials < max_trials:
+            chunk_size = min(chunk_size, max_trials - n_trials)
+            cand = distribution.sample(chunk_size)
+            batches = np.array_split(np.arange(chunk_size),
+                                     min(n_jobs, chunk_size))
+            res = parallel(
+                delayed(_check_physically_valid_samples)(scenario, cand[b])
+                for b in batches
+            )
+            is_valid = np.concatenate(res).astype(bool)
+            n_trials += chunk_size
+            samples.extend(cand[is_valid][:n_valid-len(samples)])
+            rate = len(samples) / n_trials
+            if verbose:
+                print("Valid samples: {}/{} (acceptance rate: {:.2f})".format(
+                    len(samples), n_trials, rate))
+            # Size the next chunk to get the missing samples at this rate.
+            n_missing = n_valid - len(samples)
+            rate = max(rate, 1 / n_trials)
+            chunk_size = int(np.ceil(1.2 * n_missing / rate))
+            chunk_size = -(-chunk_size // n_jobs) * n_jobs
+    if len(samples) < n_valid:
+        print("Attempt to find valid samples ran out of trials")
+    return samples
+
+
+def compute_label(scenario, sample, ret_events_labels=False,
+                  ret_events_times=False, **simu_kw):
+    """Simulate a sample and return its success label.
+
+    If ret_events_labels (resp. ret_events_times) is True, the dict of
+    event: label (resp. event: (success_time, failure_time)) pairs is
+    returned as well, after the global label.
+
+    """
     instance = scenario.instantiate_from_sample(sample, geom=None, phys=True,
                                                 verbose_causal_graph=False)
     global_label = instance.simulate(**simu_kw)
+    res = [global_label]
     if ret_events_labels:
-        events_labels = {
-            e.name: (True if e.success else False if e.failure else None)
-            for e in instance.embedded_causal_graph.get_events()
-        }
-        return global_label, events_labels
-    else:
-        return global_label
+        res.append(instance.embedded_causal_graph.get_events_labels())
+    if ret_events_times:
+        res.append(instance.embedded_causal_graph.get_events_times())
+    return tuple(res) if len(res) > 1 else global_label
+
+
+def _events_times_to_arrays(events_times):
+    """Convert a list of event: (success_time, failure_time) dicts to a dict
+    of event: (n,2) arrays, where missing times are NaN.
+
+    """
+    return {name: np.array([et[name] for et in events_times],
+                           dtype=np.float64)
+            for name in events_times[0].keys()}
 
 
 def find_successful_samples_uniform(scenario, n_succ, n_0, n_k, k_max,
                                     totals=None, **simu_kw):
     ndims = len(scenario.design_space)
     # Initialization
-    samples = find_physically_valid_samples(
+    samples = stream_physically_valid_samples(
         scenario, MultivariateUniform(ndims), n_0, 100*n_0
     )
     labels = [compute_label(scenario, s, **simu_kw) for s in samples]
@@ -112,7 +364,7 @@ def find_successful_samples_uniform(scenario, n_succ, n_0, n_k, k_max,
         if total >= n_succ:
             break
         k += 1
-        samples_k = find_physically_valid_samples(
+        samples_k = stream_physically_valid_samples(
             scenario, MultivariateUniform(ndims), n_k, 100*n_k
         )
         samples.extend(samples_k)
@@ -122,7 +374,8 @@ def find_successful_samples_uniform(scenario, n_succ, n_0, n_k, k_max,
 
 def find_successful_samples_adaptive(scenario, n_succ, n_0, n_k, k_max, sigma,
                                      ret_events_labels=False, totals=None,
-                                     verbose=True, **simu_kw):
+                                     verbose=True, ret_events_times=False,
+                                     **simu_kw):
     """Sample the design space until enough successful samples are found.
 
     Returns
@@ -135,23 +388,29 @@ def find_successful_samples_adaptive(scenario, n_succ, n_0, n_k, k_max, sigma,
       Dictionary of event:labels pairs where labels is a (n,)-list of elements
       in {True, False, None}, corresponding to the success of the event for
       each sample.
+    dict [only if ret_events_times]
+      Dictionary of event:times pairs where times is a (n,2) array of the
+      success and failure times of the event for each sample (NaN if the
+      event did not succeed or fail).
 
     """
     ndims = len(scenario.design_space)
     cov = sigma * np.eye(ndims)
     # Initialization
-    samples = find_physically_valid_samples(
+    samples = stream_physically_valid_samples(
         scenario, SobolSequence(ndims), n_0, 100*n_0
     )
     # res = [compute_label(scenario, s, True, **simu_kw) for s in samples]
     res = Parallel(n_jobs=cfg.NCORES)(
-        delayed(compute_label)(scenario, s, True, **simu_kw)
+        delayed(compute_label)(scenario, s, True, ret_events_times, **simu_kw)
         for s in tqdm(samples)
     )
-    nse = [sum(filter(None, el.values())) for _, el in res]
-    labels = [label for label, _ in res]
+    nse = [sum(filter(None, r[1].values())) for r in res]
+    labels = [r[0] for r in res]
     if ret_events_labels:
-        events_labels = [el for _, el in res]
+        events_labels = [r[1] for r in res]
+    if ret_events_times:
+        events_times = [r[2] for r in res]
     # Main loop
     k = 0
     while k < k_max:
@@ -174,28 +433,95 @@ def find_successful_samples_adaptive(scenario, n_succ, n_0, n_k, k_max, sigma,
         # Generate the new samples.
         mixture_params = [(ts, cov) for ts in top_samples]
         dist = MultivariateMixtureOfGaussians(mixture_params, weights)
-        samples_k = find_physically_valid_samples(scenario, dist, n_k, 100*n_k)
+        samples_k = stream_physically_valid_samples(scenario, dist, n_k,
+                                                    100*n_k)
         samples.extend(samples_k)
         # res_k = [compute_label(scenario, s, True, **simu_kw)
         #          for s in samples_k]
         res_k = Parallel(n_jobs=cfg.NCORES)(
-            delayed(compute_label)(scenario, s, True, **simu_kw)
+            delayed(compute_label)(scenario, s, True, ret_events_times,
+                                   **simu_kw)
             for s in tqdm(samples_k)
         )
-        nse.extend(sum(filter(None, el.values())) for _, el in res_k)
-        labels.extend(label for label, _ in res_k)
+        nse.extend(sum(filter(None, r[1].values())) for r in res_k)
+        labels.extend(r[0] for r in res_k)
         if ret_events_labels:
-            events_labels.extend(el for _, el in res_k)
+            events_labels.extend(r[1] for r in res_k)
+        if ret_events_times:
+            events_times.extend(r[2] for r in res_k)
+    out = [samples, labels]
     if ret_events_labels:
         events_labels_dict = {name: [el[name] for el in events_labels]
                               for name in events_labels[0].keys()}
-        return samples, labels, events_labels_dict
-    else:
-        return samples, labels
+        out.append(events_labels_dict)
+    if ret_events_times:
+        out.append(_events_times_to_arrays(events_times))
+    return tuple(out)
+
+
+def get_stable_folds(labels, n_folds=3):
+    """Return the cross-validation fold of each sample.
+
+    Samples of each class are assigned to the folds in turn, so that folds
+    are stratified and the fold of a sample does not change when new
+    samples are appended.
+
+    """
+    labels = np.asarray(labels)
+    test_fold = np.empty(len(labels), dtype=int)
+    for c in np.unique(labels):
+        ind = np.flatnonzero(labels == c)
+        test_fold[ind] = np.arange(len(ind)) % n_folds
+    return test_fold
+
+
+def _get_local_range(full_range, value, radius=1):
+    """Return the values of the grid within 'radius' steps of 'value'."""
+    i = np.argmin(np.abs(np.log(full_range) - np.log(value)))
+    return full_range[max(i-radius, 0):i+radius+1]
+
+
+def get_svc_params(estimator):
+    """Return the hyperparameters of a trained SVC pipeline."""
+    svc = estimator.named_steps['svc']
+    return {'svc__C': svc.C, 'svc__gamma': svc.gamma,
+            'svc__class_weight': svc.class_weight}
 
 
 def train_svc(samples, labels, probability=False, dims=None,
-              ret_xval_score=False, random_state=None, verbose=True):
+              ret_xval_score=False, random_state=None, verbose=True,
+              init_params=None, min_score=None, params=None):
+    """Train an RBF SVC, with its hyperparameters selected by
+    cross-validation.
+
+    Parameters
+    ----------
+    samples : (n,ndims) sequence
+      Training samples.
+    labels : (n,) sequence
+      Training labels.
+    probability : bool, optional
+      Whether to calibrate the probability estimates.
+    dims : sequence, optional
+      Indices of the features to use (all by default).
+    ret_xval_score : bool, optional
+      Whether to return the cross-validation score of the estimator as well
+      (None if params is given).
+    random_state : int, optional
+      Seed of the SVC.
+    verbose : bool, optional
+      Whether to print progress.
+    init_params : dict, optional
+      Best parameters of a previous search (see get_svc_params). Only their
+      neighbourhood in the grid is searched, unless the score falls below
+      'min_score', in which case the full grid is searched.
+    min_score : float, optional
+      Minimum score of the local search.
+    params : dict, optional
+      Parameters to use without search (e.g. to calibrate an estimator
+      trained previously).
+
+    """
     if verbose:
         print("Number of samples:", len(samples))
         print("Number of features:",
@@ -211,6 +537,10 @@ def train_svc(samples, labels, probability=False, dims=None,
                                        kw_args=dict(indices=dims, axis=1))
         steps.insert(0, selector)
     pipeline = make_pipeline(*steps)
+    if params is not None:
+        pipeline.set_params(**params)
+        pipeline.fit(samples, labels)
+        return (pipeline, None) if ret_xval_score else pipeline
     # Initialize cross-validation.
     C_range = np.logspace(*cfg.SVC_C_RANGE)
     gamma_range = np.logspace(*cfg.SVC_GAMMA_RANGE)
@@ -220,7 +550,99 @@ def train_svc(samples, labels, probability=False, dims=None,
         'svc__C': C_range,
         'svc__class_weight': class_weight_options
     }
-    grid = GridSearchCV(pipeline, param_grid=param_grid, cv=3,
+    # The folds of the samples are kept across calls.
+    cv = PredefinedSplit(get_stable_folds(labels))
+    if init_params is not None:
+        local_grid = {
+            'svc__gamma': _get_local_range(gamma_range,
+                                           init_params['svc__gamma']),
+            'svc__C': _get_local_range(C_range, init_params['svc__C']),
+            'svc__class_weight': class_weight_options
+        }
+        grid = GridSearchCV(pipeline, param_grid=local_grid, cv=cv,
+                            n_jobs=cfg.NCORES, iid=False)
+        grid.fit(samples, labels)
+        if min_score is not None and grid.best_score_ < min_score:
+            if verbose:
+                print("Score dropped to {}; searching the full grid".format(
+                    grid.best_score_))
+            grid = None
+    else:
+        grid = None
+    if grid is None:
+        grid = GridSearchCV(pipeline, param_grid=param_grid, cv=cv,
+                            n_jobs=cfg.NCORES, iid=False)
+        # Run cross-validation.
+        grid.fit(samples, labels)
+    if verbose:
+        print("The best parameters are {}".format(grid.best_params_))
+        print("Score on the training set: {}".format(grid.best_score_))
+    if ret_xval_score:
+        return grid.best_estimator_, grid.best_score_
+    else:
+        return grid.best_estimator_
+
+
+class IncrementalPipeline(Pipeline):
+    """Pipeline whose final estimator can be updated with partial_fit.
+
+    The transformers are fitted on the first batch and then kept fixed, so
+    that the features seen by the final estimator do not change between
+    updates.
+
+    """
+    def partial_fit(self, X, y, classes=None):
+        final = self.steps[-1][1]
+        if hasattr(final, 'coef_'):
+            Xt = X
+            for _, transformer in self.steps[:-1]:
+                Xt = transformer.transform(Xt)
+        else:
+            Xt = Pipeline(self.steps[:-1]).fit_transform(X, y)
+            if classes is None:
+                classes = np.unique(y)
+        final.partial_fit(Xt, y, classes=classes)
+        return self
+
+
+def train_approx_svc(samples, labels, dims=None, ret_xval_score=False,
+                     random_state=None, verbose=True):
+    """Train an approximate RBF kernel classifier, with its hyperparameters
+    selected by cross-validation.
+
+    The samples are mapped to random Fourier features of the RBF kernel and
+    classified by a logistic regression trained with SGD. The training cost
+    is linear in the number of samples, and the estimator can be updated
+    with new samples with partial_fit. Probabilities are given directly by
+    the logistic regression.
+
+    Parameters are the same as for train_svc.
+
+    """
+    if verbose:
+        print("Number of samples:", len(samples))
+        print("Number of features:",
+              len(dims) if dims is not None else len(samples[0]))
+    # Create pipeline.
+    steps = [
+        ('standardscaler', StandardScaler()),
+        ('rbfsampler', RBFSampler(n_components=cfg.RFF_N_COMPONENTS,
+                                  random_state=random_state)),
+        ('sgdclassifier', SGDClassifier(loss='log', max_iter=1000, tol=1e-3,
+                                        random_state=random_state)),
+    ]
+    if dims is not None:
+        selector = FunctionTransformer(np.take, validate=True,
+                                       kw_args=dict(indices=dims, axis=1))
+        steps.insert(0, ('functiontransformer', selector))
+    pipeline = IncrementalPipeline(steps)
+    # Initialize cross-validation.
+    param_grid = {
+        'rbfsampler__gamma': np.logspace(*cfg.SVC_GAMMA_RANGE),
+        'sgdclassifier__alpha': np.logspace(*cfg.SGD_ALPHA_RANGE),
+    }
+    grid = GridSearchCV(pipeline, param_grid=param_grid,
+                        cv=PredefinedSplit(get_stable_folds(labels)),
                         n_jobs=cfg.NCORES, iid=False)
     # Run cross-validation.
     grid.fit(samples, labels)
@@ -235,10 +657,17 @@ def train_svc(samples, labels, probability=False, dims=None,
 
 def learn_active(scenario, init_samples, init_labels, sampler, accuracy=.9,
                  n_k=10, k_max=10, dims=None, event=None, step_data=None,
-                 **simu_kw):
+                 backend='svc', **simu_kw):
     """
     Run the active learning routine.
 
+    With backend='svc', an exact SVC is retrained at each step (see
+    train_svc). With backend='approx', an approximate kernel classifier (see
+    train_approx_svc) is trained once and then updated with the new samples
+    only; a fixed part of the initial samples (see
+    cfg.APPROX_VALIDATION_FOLDS) is held out of its training, and its score
+    at each step is its accuracy on these samples.
+
     Returns
     -------
     estimator : sklearn.pipeline.Pipeline
@@ -257,9 +686,23 @@ def learn_active(scenario, init_samples, init_labels, sampler, accuracy=.9,
     y = [init_labels[i] for i in valid]
     # Train the SVC.
     print("Training the estimator")
-    estimator, score = train_svc(X, y, dims=dims, ret_xval_score=True)
+    if backend == 'approx':
+        is_val = get_stable_folds(y, cfg.APPROX_VALIDATION_FOLDS) == 0
+        X_val = np.asarray(X)[is_val]
+        y_val = np.asarray(y)[is_val]
+        estimator = train_approx_svc(
+            [x for x, v in zip(X, is_val) if not v],
+            [l for l, v in zip(y, is_val) if not v], dims=dims
+        )
+        score = estimator.score(X_val, y_val)
+        print("Score on the validation set: {}".format(score))
+    else:
+        estimator, score = train_svc(X, y, dims=dims, ret_xval_score=True)
     if step_data is not None:
-        step_data.append((np.copy(X), np.copy(y), estimator, score))
+        # The approximate estimator is updated in place.
+        step_estimator = (copy.deepcopy(estimator)
+                          if backend == 'approx' else estimator)
+        step_data.append((np.copy(X), np.copy(y), step_estimator, score))
     k = 0
     # Main loop
     while k < k_max and score < accuracy:
@@ -268,11 +711,13 @@ def learn_active(scenario, init_samples, init_labels, sampler, accuracy=.9,
         D = sampler(X, y, estimator, dims)
         if D is None:
             break
-        cand = find_physically_valid_samples(scenario, D, 10*n_k, 1000*n_k)
+        cand = stream_physically_valid_samples(scenario, D, 10*n_k,
+                                               1000*n_k)
         cand = np.asarray(cand)
         margin = np.abs(estimator.decision_function(cand))
         X_k = cand[np.argpartition(margin, n_k)[:n_k]]  # n_k smallest margins
         # Query the new samples and add them to the training set.
+        n = len(X)
         if event is None:
             X.extend(X_k)
             y.extend(compute_label(scenario, x, **simu_kw) for x in X_k)
@@ -282,15 +727,33 @@ def learn_active(scenario, init_samples, init_labels, sampler, accuracy=.9,
             valid = [i for i, l in enumerate(y_k) if l is not None]
             X.extend(X_k[i] for i in valid)
             y.extend(y_k[i] for i in valid)
-        # Train the SVC.
-        print("Training the estimator")
-        estimator, score = train_svc(X, y, dims=dims, ret_xval_score=True)
+        if backend == 'approx':
+            # Update the estimator with the new samples.
+            print("Updating the estimator")
+            if len(X) > n:
+                estimator.partial_fit(np.asarray(X[n:]), np.asarray(y[n:]))
+            score = estimator.score(X_val, y_val)
+            print("Score on the validation set: {}".format(score))
+        else:
+            # Train the SVC, starting from the previous best parameters.
+            print("Training the estimator")
+            estimator, score = train_svc(
+                X, y, dims=dims, ret_xval_score=True,
+                init_params=get_svc_params(estimator),
+                min_score=score-cfg.SVC_SCORE_DROP_TOL
+            )
         if step_data is not None:
-            step_data.append((np.copy(X), np.copy(y), estimator, score))
+            # The approximate estimator is updated in place.
+            step_estimator = (copy.deepcopy(estimator)
+                              if backend == 'approx' else estimator)
+            step_data.append((np.copy(X), np.copy(y), step_estimator, score))
         k += 1
+    if backend == 'approx':
+        return estimator
     # Calibrate
     print("Calibrating the classifier")
-    estimator = train_svc(X, y, probability=True, dims=dims, verbose=False)
+    estimator = train_svc(X, y, probability=True, dims=dims, verbose=False,
+                          params=get_svc_params(estimator))
     return estimator
 
 
@@ -308,7 +771,8 @@ def _get_uniform_distrib(X, y, estimator, dims=None):
 
 def train_and_add_uniform_samples(scenario, init_samples, init_labels,
                                   accuracy=.9, n_k=10, k_max=10, dims=None,
-                                  event=None, step_data=None, **simu_kw):
+                                  event=None, step_data=None, backend='svc',
+                                  **simu_kw):
     """
     Train the SVC and add more uniform samples until accuracy is reached.
 
@@ -321,7 +785,7 @@ def train_and_add_uniform_samples(scenario, init_samples, init_labels,
     return learn_active(
         scenario, init_samples, init_labels, _get_uniform_distrib,
         accuracy, n_k, k_max, dims, event,
-        step_data, **simu_kw
+        step_data, backend, **simu_kw
     )
 
 
@@ -340,15 +804,15 @@ def _get_misclassified_distrib(X, y, estimator, dims=None):
         fulldiag = np.zeros(X.shape[1])
         fulldiag[dims] = diag
         diag = fulldiag
-    scale = np.diagflat(diag)
-    mixture_params = [(xi, afi*scale)
+    mixture_params = [(xi, afi*diag)
                       for xi, afi in zip(wrong_X, wrong_af)]
     return MultivariateMixtureOfGaussians(mixture_params, weights)
 
 
 def train_and_consolidate_boundary(scenario, init_samples, init_labels,
                                    accuracy=.9, n_k=10, k_max=10, dims=None,
-                                   event=None, step_data=None, **simu_kw):
+                                   event=None, step_data=None, backend='svc',
+                                   **simu_kw):
     """
     Train the SVC and consolidate the boundary around its misclassified samples
     until accuracy is reached.
@@ -362,14 +826,21 @@ def train_and_consolidate_boundary(scenario, init_samples, init_labels,
     return learn_active(
         scenario, init_samples, init_labels, _get_misclassified_distrib,
         accuracy, n_k, k_max, dims, event,
-        step_data, **simu_kw
+        step_data, backend, **simu_kw
     )
 
 
 def _get_support_distrib(X, y, estimator, dims=None):
     X = np.asarray(X)
     # Retrieve the support vectors.
-    support = estimator.named_steps['svc'].support_
+    try:
+        support = estimator.named_steps['svc'].support_
+    except KeyError:
+        # Approximate kernel backend: use the samples within the margin.
+        margin = np.abs(estimator.decision_function(X))
+        support = np.flatnonzero(margin <= 1)
+        if not support.size:
+            support = np.argsort(margin)[:max(len(X) // 10, 1)]
     # Compute weights.
     af = np.abs(estimator.decision_function(X[support]))
     weights = af / af.sum()
@@ -380,15 +851,15 @@ def _get_support_distrib(X, y, estimator, dims=None):
         fulldiag = np.zeros(X.shape[1])
         fulldiag[dims] = diag
         diag = fulldiag
-    scale = np.diagflat(diag)
-    mixture_params = [(X[si], afi*scale)
+    mixture_params = [(X[si], afi*diag)
                       for si, afi in zip(support, af)]
     return MultivariateMixtureOfGaussians(mixture_params, weights)
 
 
 def train_and_consolidate_boundary2(scenario, init_samples, init_labels,
                                     accuracy=.9, n_k=10, k_max=10, dims=None,
-                                    event=None, step_data=None, **simu_kw):
+                                    event=None, step_data=None, backend='svc',
+                                    **simu_kw):
     """
     Train the SVC and consolidate the boundary around its support vectors until
     accuracy is reached.
@@ -402,7 +873,7 @@ def train_and_consolidate_boundary2(scenario, init_samples, init_labels,
     return learn_active(
         scenario, init_samples, init_labels, _get_support_distrib,
         accuracy, n_k, k_max, dims, event,
-        step_data, **simu_kw
+        step_data, backend, **simu_kw
     )
 
 
@@ -1,13 +1,22 @@
+import ast
+import builtins
 import hashlib
 import importlib.util
+import inspect
 import json
+import os
 import pickle
+import random
 import subprocess
+import threading
+import types
 from itertools import combinations, count
 from math import ceil
 
 import networkx as nx
-from panda3d.core import GeomVertexReader, NodePath, TransformState
+import numpy as np
+from panda3d.core import (BamFile, Filename, GeomVertexReader, NodePath,
+                          TransformState)
 from shapely.geometry import LineString
 
 from . import config as cfg
@@ -15,6 +24,75 @@ from . import causal_graph as causal
 from . import primitives
 from .design_space import load_design_space
 from .export import VectorFile
+from .gltf import export_glb
+from .trajectory import resample_states
+
+
+class GeometryCache:
+    """Cache of the static geometry of primitives, shared across scenes.
+
+    Geometry is keyed by a hash of the type and constructor arguments of
+    each primitive (excluding physics-only arguments), so that scenes which
+    only differ by transforms or forces reuse the same meshes. Each entry is
+    kept in memory and stored on disk as .bam and .egg files.
+
+    Only simple primitives (i.e. without components) are cached.
+
+    Parameters
+    ----------
+    directory : string, optional
+      Directory where the per-object files are stored.
+
+    """
+    physics_args = ('bt_props', 'force')
+
+    def __init__(self, directory=cfg.GEOMETRY_CACHE_DIR):
+        self.directory = directory
+        self._nodes = {}
+
+    def get_key(self, prim, geom):
+        args = {k: v for k, v in vars(prim).items()
+                if k not in self.physics_args}
+        data = json.dumps([type(prim).__name__, geom, args],
+                          sort_keys=True, default=repr)
+        return hashlib.md5(data.encode('utf-8')).hexdigest()
+
+    def get_filename(self, prim, geom, ext=".egg"):
+        return os.path.join(self.directory, self.get_key(prim, geom) + ext)
+
+    def load(self, prim, geom, parent):
+        """Attach a copy of the primitive's geometry to 'parent'."""
+        key = self.get_key(prim, geom)
+        try:
+            nopa = self._nodes[key]
+        except KeyError:
+            filename = os.path.join(self.directory, key)
+            if os.path.isfile(filename + ".egg"):
+                bam = BamFile()
+                bam.open_read(Filename.from_os_specific(filename + ".bam"))
+                nopa = NodePath(bam.read_node())
+                bam.close()
+            else:
+                os.makedirs(self.directory, exist_ok=True)
+                nopa = prim.create(geom, False)
+                # Files are written under a temporary name and moved in
+                # place, so that concurrent processes never read a partial
+                # entry. The .egg is moved last as it marks the entry valid.
+                tmp = "{}.{}".format(filename, os.getpid())
+                try:
+                    nopa.write_bam_file(tmp + ".bam")
+                    subprocess.run(
+                        ["bam2egg", "-o", tmp + ".egg", tmp + ".bam"],
+                        check=True
+                    )
+                    os.replace(tmp + ".bam", filename + ".bam")
+                    os.replace(tmp + ".egg", filename + ".egg")
+                finally:
+                    for ext in (".bam", ".egg"):
+                        if os.path.isfile(tmp + ext):
+                            os.remove(tmp + ext)
+            self._nodes[key] = nopa
+        return nopa.copy_to(parent)
 
 
 class Scene:
@@ -22,6 +100,10 @@ class Scene:
         self.geom = geom
         self.phys = phys
         self.graph = NodePath("scene")
+        # List of (NodePath, filename) pairs of the objects whose geometry
+        # comes from a GeometryCache, and keys of all their nodes.
+        self.cached_objects = []
+        self._cached_nodes = set()
         if phys:
             self.world = primitives.World()
             self.world.set_gravity(cfg.GRAVITY)
@@ -37,6 +119,61 @@ class Scene:
         self.graph.write_bam_file(filename + ".bam")
         subprocess.run(["bam2egg", "-o", filename + ".egg", filename + ".bam"])
 
+    def export_scene_to_glb(self, filename, states=None, fps=None):
+        """Export the scene and its (optional) animation to binary glTF.
+
+        Parameters
+        ----------
+        filename : string
+          Output file (".glb" is appended if missing).
+        states : dict, optional
+          States recorded by a StateObserver, baked as animation channels.
+        fps : float, optional
+          Frequency at which the states were recorded.
+
+        """
+        if filename[-4:] != ".glb":
+            filename += ".glb"
+        export_glb(self.graph, filename, states, fps)
+
+    def export_scene_to_manifest(self, filename):
+        """Export the scene as a list of cached geometry files + transforms.
+
+        Only valid for scenes populated with a GeometryCache: the geometry
+        itself is shared across scenes, so the per-scene output only carries
+        the hierarchy and transform of each object.
+
+        Raises a ValueError if the scene contains nodes that do not come from
+        the cache (e.g. created by composite primitives), since they would be
+        missing from the manifest.
+
+        """
+        if filename[-5:] != ".json":
+            filename += ".json"
+        uncached = [p.get_name() for p in self.graph.find_all_matches("**")
+                    if p != self.graph
+                    and p.get_key() not in self._cached_nodes]
+        if uncached:
+            raise ValueError(
+                "Cannot export {} as a manifest: nodes {} do not come from "
+                "the geometry cache (only simple primitives are cached). "
+                "Export this scene without the geometry cache.".format(
+                    filename, uncached)
+            )
+        objects = []
+        for nopa, geom_file in self.cached_objects:
+            parent = nopa.get_parent()
+            objects.append({
+                'name': nopa.get_name(),
+                'file': os.path.abspath(geom_file),
+                'parent': None if parent == self.graph else parent.get_name(),
+                'pos': list(nopa.get_pos()),
+                'quat': list(nopa.get_quat()),
+                'scale': list(nopa.get_scale()),
+            })
+        with open(filename, 'w') as f:
+            json.dump({'objects': objects}, f, indent=1)
+
     def export_layout_to_pdf(self, filename, sheetsize, plane='xy',
                              exclude=None, flip_u=False, flip_v=False):
         if exclude is None:
@@ -164,7 +301,7 @@ class Scene:
         TransformState.garbage_collect()
         return constraint
 
-    def populate(self, prim_graph, xforms):
+    def populate(self, prim_graph, xforms, geom_cache=None):
         """Populate the scene with primitive instances.
 
         Parameters
@@ -175,15 +312,30 @@ class Scene:
         xforms : dict
           Dictionary of o_name: o_xform pairs, where o_xform is a 6-tuple
           corresponding to panda3d's (x,y,z,h,p,r) values.
+        geom_cache : GeometryCache, optional
+          Cache where the geometry of simple primitives is taken from. Only
+          used for scenes without physics.
 
         """
         graph = self.graph
         world = self.world
         name2nopa = {}
+        use_cache = (geom_cache is not None and self.geom is not None
+                     and not self.phys)
         # First pass: create and add simple objects.
         for name, prim in prim_graph.nodes(data='prim'):
             if 'components' not in prim_graph.nodes[name]:
-                nopa = prim.create(self.geom, self.phys, graph, world)
+                if use_cache:
+                    nopa = geom_cache.load(prim, self.geom, graph)
+                    self.cached_objects.append(
+                        (nopa, geom_cache.get_filename(prim, self.geom))
+                    )
+                    self._cached_nodes.add(nopa.get_key())
+                    self._cached_nodes.update(
+                        p.get_key() for p in nopa.find_all_matches("**")
+                    )
+                else:
+                    nopa = prim.create(self.geom, self.phys, graph, world)
                 if xforms[name] is not None:
                     nopa.set_pos_hpr(*xforms[name])
                 name2nopa[name] = nopa
@@ -326,30 +478,294 @@ class StateObserver:
                 self.states[key].append(state)
                 prev[key] = state[1:]
 
-    def export(self, filename, **metadata):
+    def export(self, filename, resample_fps=None, **metadata):
+        """Save the states to a .pkl file.
+
+        By default the exact times at which states were recorded are kept.
+        If resample_fps is given, every trajectory is instead interpolated at
+        each frame of a video at this rate (see trajectory.resample_states);
+        'fps' in the metadata, if given, is the recording rate and is
+        replaced by resample_fps ('sim_fps' keeps the original).
+
+        """
         if filename[-4:] != ".pkl":
             filename += ".pkl"
-        data = {'metadata': metadata, 'states': self.states}
+        states = self.states
+        if resample_fps is not None:
+            # Frame rates are integers in Blender.
+            resample_fps = int(round(resample_fps))
+            sim_fps = metadata.get('fps')
+            dt = 1 / sim_fps if sim_fps else None
+            states = resample_states(states, resample_fps, dt)
+            metadata['sim_fps'] = sim_fps
+            metadata['fps'] = resample_fps
+        data = {'metadata': metadata, 'states': states}
         with open(filename, 'wb') as f:
             pickle.dump(data, f)
 
+
+class ContactRecorder:
+    """Records the onset and offset of contacts between pairs of bodies.
+
+    Bullet's contact manifolds are read once per call (i.e. per simulation
+    step when used as a callback of simulate_scene), and an entry is only
+    added when a pair starts or stops touching. Contacts still active at the
+    end of the simulation have no offset.
+
+    """
+    ONSET = 1
+    OFFSET = 0
+
+    def __init__(self, scene: Scene):
+        self.world = scene.world
+        self.names = []
+        self._name_ids = dict()
+        # Dict of (id0, id1): (point, impulse) of the pairs in contact.
+        self._active = dict()
+        self.times = []
+        self.first = []
+        self.second = []
+        self.kinds = []
+        self.points = []
+        self.impulses = []
+
+    def _get_id(self, name):
+        try:
+            return self._name_ids[name]
+        except KeyError:
+            self.names.append(name)
+            i = self._name_ids[name] = len(self.names) - 1
+            return i
+
+    def _add(self, time, pair, kind, point, impulse):
+        self.times.append(time)
+        self.first.append(pair[0])
+        self.second.append(pair[1])
+        self.kinds.append(kind)
+        self.points.append(point)
+        self.impulses.append(impulse)
+
+    def __call__(self, time):
+        current = dict()
+        for manifold in self.world.get_manifolds():
+            # Manifolds keep points that are within the contact breaking
+            # threshold but not touching; only penetrating points count.
+            points = [manifold.get_manifold_point(i)
+                      for i in range(manifold.get_num_manifold_points())]
+            points = [p for p in points if p.get_distance() <= 0]
+            if not points:
+                continue
+            pair = tuple(sorted((self._get_id(manifold.get_node0().name),
+                                 self._get_id(manifold.get_node1().name))))
+            impulse = sum(p.get_applied_impulse() for p in points)
+            pos = [p.get_position_world_on_b() for p in points]
+            point = [sum(p[i] for p in pos) / len(pos) for i in range(3)]
+            if pair in current:
+                impulse += current[pair][1]
+            current[pair] = (point, impulse)
+        active = self._active
+        for pair, (point, impulse) in current.items():
+            if pair not in active:
+                self._add(time, pair, self.ONSET, point, impulse)
+        for pair, (point, _) in active.items():
+            if pair not in current:
+                self._add(time, pair, self.OFFSET, point, 0.)
+        self._active = current
+
+    def get_arrays(self):
+        """Return the contact log as a dict of columnar arrays.
+
+        'time', 'first' and 'second' (indices in 'names'), 'kind' (ONSET or
+        OFFSET), 'point' ((n,3) mean contact point in world coordinates) and
+        'impulse' (total normal impulse at onset).
+
+        """
+        return {
+            'names': np.array(self.names),
+            'time': np.array(self.times, dtype=np.float64),
+            'first': np.array(self.first, dtype=np.int32),
+            'second': np.array(self.second, dtype=np.int32),
+            'kind': np.array(self.kinds, dtype=np.int8),
+            'point': np.array(self.points, dtype=np.float32).reshape(-1, 3),
+            'impulse': np.array(self.impulses, dtype=np.float32),
+        }
+
+    def export(self, filename):
+        if filename[-4:] != ".npz":
+            filename += ".npz"
+        np.savez_compressed(filename, **self.get_arrays())
+
+
+class RandomModule(types.ModuleType):
+    """Stand-in for the 'random' module whose functions draw from 'rng'.
+
+    Used to run scenario scripts written against the global 'random' module
+    with a per-trace generator.
+
+    """
+    def __init__(self, rng):
+        super().__init__("random")
+        self.rng = rng
+
+    def __getattr__(self, name):
+        try:
+            return getattr(self.rng, name)
+        except AttributeError:
+            return getattr(random, name)
+
+
+class ScenarioScript:
+    """Scenario script loaded once, to generate the data of many traces.
+
+    Two kinds of scripts are supported: those defining a
+    get_scene_data(gen_json_path[, rng]) function, which is called for each
+    trace, and those drawing their random choices at module level and
+    defining DATA, whose compiled code is executed again for each trace.
+
+    For both kinds, the random choices of a trace are stored in its Gen JSON
+    file, if given, and loaded from it if it exists (module-level scripts
+    store the whole scene data).
+
+    Each trace draws from its own random.Random, so traces can be generated
+    concurrently and each one only depends on its seed. Module-level scripts
+    get it in place of the 'random' module they import. Scripts defining
+    get_scene_data without an 'rng' argument are run with their 'random'
+    module temporarily replaced (one trace at a time).
+
+    Parameters
+    ----------
+    path : string
+      Path to the scenario script.
+
+    """
+    _legacy_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'r') as f:
+            source = f.read()
+        tree = ast.parse(source, path)
+        self.code = compile(tree, path, 'exec')
+        # Scripts defining get_scene_data are only executed once.
+        if any(isinstance(node, ast.FunctionDef)
+               and node.name == "get_scene_data" for node in tree.body):
+            self.module = load_module("loaded_script", path)
+            params = inspect.signature(self.module.get_scene_data).parameters
+            self.takes_rng = 'rng' in params
+        else:
+            self.module = None
+
+    def get_scene_data(self, gen_json_path=None, seed=None, rng=None):
+        """Return the scenario data of one trace.
+
+        Parameters
+        ----------
+        gen_json_path : string, optional
+          Gen JSON file of the trace.
+        seed : int, optional
+          Seed of the random choices, if 'rng' is not given. Unseeded if None.
+        rng : random.Random, optional
+          Generator of the random choices.
+
+        """
+        if rng is None:
+            rng = random.Random(seed)
+        if self.module is not None:
+            if self.takes_rng:
+                return self.module.get_scene_data(gen_json_path, rng=rng)
+            with self._legacy_lock:
+                self.module.random = RandomModule(rng)
+                try:
+                    return self.module.get_scene_data(gen_json_path)
+                finally:
+                    self.module.random = random
+        if gen_json_path is not None and os.path.exists(gen_json_path):
+            with open(gen_json_path, 'r') as f:
+                return json.load(f)
+        scenario_data = self.run_script(rng)
+        if gen_json_path is not None:
+            with open(gen_json_path, 'w') as f:
+                json.dump(scenario_data, f)
+        return scenario_data
+
+    def run_script(self, rng):
+        """Execute a module-level script and return its DATA."""
+        rng_module = RandomModule(rng)
+
+        def import_(name, globals=None, locals=None, fromlist=(), level=0):
+            if name == "random" and level == 0:
+                return rng_module
+            return builtins.__import__(name, globals, locals, fromlist, level)
+
+        namespace = {
+            '__name__': "loaded_script",
+            '__file__': self.path,
+            '__builtins__': dict(vars(builtins), __import__=import_),
+        }
+        exec(self.code, namespace)
+        return namespace['DATA']
+
+
+_scenario_scripts = {}
+
+
+def get_scenario_script(py_scenario_path):
+    """Return the ScenarioScript of a path, loading it only once (or again
+    if the file changed).
+
+    """
+    key = (os.path.abspath(py_scenario_path),
+           os.path.getmtime(py_scenario_path))
+    try:
+        return _scenario_scripts[key]
+    except KeyError:
+        script = _scenario_scripts[key] = ScenarioScript(py_scenario_path)
+        return script
+
+
 # adapted for our purposes
 # takes the py_scenario_path (e.g. 'scenarios/occlusion_Gen.py')
 # and also the Gen JSON path to return scenario data based on
 # Gen random choices
-def import_scenario_data(py_scenario_path, gen_json_path):
+def import_scenario_data(py_scenario_path, gen_json_path=None, seed=None,
+                         rng=None):
     if py_scenario_path.endswith("json"):
-        with open(path, 'r') as f:
+        with open(py_scenario_path, 'r') as f:
             scenario_data = json.load(f)
     elif py_scenario_path.endswith("py"):
-        script = load_module("loaded_script", py_scenario_path)
-        scenario_data = script.get_scene_data(gen_json_path)
+        script = get_scenario_script(py_scenario_path)
+        scenario_data = script.get_scene_data(gen_json_path, seed, rng)
     else:
         print("Unrecognized extension")
         scenario_data = None
     return scenario_data
 
 
+def generate_scenario_data(py_scenario_path, gen_json_paths, seeds=None):
+    """Generate and save the scenario data of many traces in one process.
+
+    Parameters
+    ----------
+    py_scenario_path : string
+      Path to the scenario script.
+    gen_json_paths : sequence
+      Gen JSON file of each trace. Existing files are kept.
+    seeds : sequence, optional
+      Seed of each trace (e.g. the trace numbers), for reproducible traces.
+
+    Returns
+    -------
+    scenario_data : list
+      Scenario data of each trace.
+
+    """
+    script = get_scenario_script(py_scenario_path)
+    if seeds is None:
+        seeds = [None] * len(gen_json_paths)
+    return [script.get_scene_data(path, seed)
+            for path, seed in zip(gen_json_paths, seeds)]
+
+
 def load_module(name, path):
     spec = importlib.util.spec_from_file_location(name, path)
     module = importlib.util.module_from_spec(spec)
@@ -415,12 +831,12 @@ def load_scenario_instance(scenario_data, geom='LD', phys=True):
     return scenario.instantiante_from_xforms(xforms, geom, phys)
 
 
-def load_scene(scene_data, geom='LD', phys=True):
+def load_scene(scene_data, geom='LD', phys=True, geom_cache=None):
     """Load a scene from a scene data dict."""
     prim_graph = load_primitives(scene_data)
     xforms = load_xforms(scene_data)
     scene = Scene(geom, phys)
-    scene.populate(prim_graph, xforms)
+    scene.populate(prim_graph, xforms, geom_cache)
     return scene
 
 
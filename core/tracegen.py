@@ -0,0 +1,181 @@
+"""
+Rejection sampling of the traces of a scenario script.
+
+Candidate traces (i.e. seeds of the scenario script) are checked for
+physical validity and simulated at low fidelity (no geometry, large
+timestep) in parallel. Only the traces whose events have the requested
+outcomes are kept, before any expensive export or rendering.
+
+"""
+import os
+
+from joblib import delayed, Parallel
+
+from . import config as cfg
+from .scenario import import_scenario_data, load_scenario, load_xforms
+
+
+def evaluate_trace(py_scenario_path, seed, causal_graph=None,
+                   gen_json_path=None, duration=cfg.TRACEGEN_DURATION,
+                   timestep=cfg.TRACEGEN_TIMESTEP):
+    """Check the validity of a trace and simulate it at low fidelity.
+
+    Parameters
+    ----------
+    py_scenario_path : string
+      Path to the scenario script.
+    seed : int
+      Seed of the trace.
+    causal_graph : sequence, optional
+      Causal graph data (same format as in scenario scripts) used instead of
+      the one of the script, if any.
+    gen_json_path : string, optional
+      Gen JSON file of the trace. If it exists, the trace it describes is
+      evaluated (since it is the one that will be rendered) instead of
+      drawing one from the seed. It is not created otherwise.
+    duration : float, optional
+      Duration of the simulation.
+    timestep : float, optional
+      Timestep of the simulation.
+
+    Returns
+    -------
+    result : dict
+      'seed', 'valid' (bool), 'success' (bool, or None if the trace is
+      invalid or has no causal graph), 'events' (dict of event: label
+      pairs, where label is in {True, False, None}) and, for simulated
+      traces with a causal graph, 'events_times' (dict of event:
+      (success_time, failure_time) pairs).
+
+    """
+    if gen_json_path is not None and not os.path.isfile(gen_json_path):
+        gen_json_path = None
+    scenario_data = dict(import_scenario_data(py_scenario_path, gen_json_path,
+                                              seed=seed))
+    if causal_graph is not None:
+        scenario_data['causal_graph'] = causal_graph
+    scenario = load_scenario(scenario_data)
+    xforms = load_xforms(scenario_data['scene'])
+    instance = scenario.instantiante_from_xforms(
+        xforms, geom=None, phys=True, verbose_causal_graph=False)
+    result = {'seed': seed, 'valid': False, 'success': None, 'events': {}}
+    if not instance.scene.check_physically_valid():
+        return result
+    result['valid'] = True
+    result['success'] = instance.simulate(duration, timestep)
+    if instance.embedded_causal_graph is not None:
+        result['events'] = instance.embedded_causal_graph.get_events_labels()
+        result['events_times'] = \
+            instance.embedded_causal_graph.get_events_times()
+    return result
+
+
+def is_accepted(result, outcomes=None, success=None):
+    """Whether a trace is valid and its events have the requested outcomes.
+
+    Parameters
+    ----------
+    result : dict
+      Output of evaluate_trace.
+    outcomes : dict, optional
+      Dictionary of event: label pairs.
+    success : bool, optional
+      Requested global outcome of the causal graph.
+
+    """
+    if not result['valid']:
+        return False
+    if success is not None and result['success'] != success:
+        return False
+    if outcomes:
+        events = result['events']
+        return all(events.get(name) == label
+                   for name, label in outcomes.items())
+    return True
+
+
+def get_gen_json_path(scenario_dir, trace):
+    """Return the path of the Gen JSON file of a trace (None if scenario_dir
+    is None).
+
+    """
+    if scenario_dir is None:
+        return None
+    return os.path.join(scenario_dir, '{}.gen.json'.format(trace))
+
+
+def sample_traces(py_scenario_path, n_traces, outcomes=None, success=None,
+                  causal_graph=None, first_seed=0, max_trials=None,
+                  batch_size=None, n_jobs=cfg.NCORES, verbose=True,
+                  scenario_dir=None, **simu_kw):
+    """Draw candidate traces until n_traces of them are accepted.
+
+    Candidates are the consecutive seeds from first_seed, evaluated in
+    parallel batches. The accepted seeds can be used as trace numbers by
+    the rest of the pipeline, which seeds each trace with its number.
+
+    Parameters
+    ----------
+    py_scenario_path : string
+      Path to the scenario script.
+    n_traces : int
+      Number of traces to accept.
+    outcomes : dict, optional
+      Dictionary of event: label pairs that accepted traces must satisfy.
+    success : bool, optional
+      Requested global outcome of the causal graph.
+    causal_graph : sequence, optional
+      Causal graph data attached to the scenario (see evaluate_trace).
+    first_seed : int, optional
+      First candidate seed.
+    max_trials : int, optional
+      Maximum number of candidates. Defaults to 100*n_traces.
+    batch_size : int, optional
+      Number of candidates per batch. Defaults to 4*n_jobs.
+    n_jobs : int, optional
+      Number of parallel workers.
+    verbose : bool, optional
+      Whether to print the acceptance rate after each batch.
+    scenario_dir : string, optional
+      Directory of the Gen JSON files of the traces. Candidates which
+      already have one are evaluated from it (see evaluate_trace).
+    simu_kw : dict, optional
+      Simulation parameters passed to evaluate_trace.
+
+    Returns
+    -------
+    accepted : list
+      Accepted seeds (at most n_traces), in increasing order.
+    results : list
+      Results of all the candidates evaluated.
+
+    """
+    if max_trials is None:
+        max_trials = 100 * n_traces
+    if batch_size is None:
+        batch_size = 4 * n_jobs
+    accepted = []
+    results = []
+    seed = first_seed
+    end = first_seed + max_trials
+    with Parallel(n_jobs=n_jobs) as parallel:
+        while len(accepted) < n_traces and seed < end:
+            seeds = range(seed, min(seed + batch_size, end))
+            seed = seeds[-1] + 1
+            batch = parallel(
+                delayed(evaluate_trace)(py_scenario_path, s, causal_graph,
+                                        get_gen_json_path(scenario_dir, s),
+                                        **simu_kw)
+                for s in seeds
+            )
+            results.extend(batch)
+            accepted.extend(r['seed'] for r in batch
+                            if is_accepted(r, outcomes, success))
+            if verbose:
+                n_valid = sum(r['valid'] for r in results)
+                print("Accepted {} of {} candidates ({} valid)".format(
+                    len(accepted), len(results), n_valid))
+    if len(accepted) < n_traces:
+        print("Trace sampling ran out of trials")
+    return accepted[:n_traces], results
+
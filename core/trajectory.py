@@ -0,0 +1,192 @@
+"""
+Vectorized sampling of the trajectories recorded by a StateObserver.
+
+States are [t, x, y, z, w, i, j, k(, sx, sy, sz)] rows, local to the parent
+node, and only recorded when the object moves.
+
+"""
+import numpy as np
+
+
+def sample_states(o_states, times):
+    """Return the (n,k) states of an object at the given times.
+
+    The last state recorded before each time is held.
+
+    """
+    o_states = np.asarray(o_states, dtype=np.float64)
+    ind = np.searchsorted(o_states[:, 0], times, side='right') - 1
+    return o_states[np.clip(ind, 0, None)]
+
+
+def insert_holds(o_states, dt):
+    """Return the states with a copy of the previous state inserted before
+    each gap in the recorded times.
+
+    Since states are only recorded when the object moves, this keeps the
+    object still until dt before the next recorded state, so that
+    interpolation does not smear the motion over the time it was static.
+
+    """
+    states = np.asarray(o_states, dtype=np.float64)
+    if len(states) < 2:
+        return states
+    gaps = np.flatnonzero(np.diff(states[:, 0]) > 1.5 * dt) + 1
+    holds = states[gaps - 1].copy()
+    holds[:, 0] = states[gaps, 0] - dt
+    return np.insert(states, gaps, holds, axis=0)
+
+
+def slerp(q0, q1, alpha):
+    """Spherical linear interpolation of (n,4) unit quaternions."""
+    dot = np.einsum('ij,ij->i', q0, q1)
+    # Take the shortest path.
+    q1 = np.where(dot[:, None] < 0, -q1, q1)
+    dot = np.clip(np.abs(dot), 0, 1)
+    theta = np.arccos(dot)
+    sin_theta = np.sin(theta)
+    small = sin_theta < 1e-6
+    with np.errstate(divide='ignore', invalid='ignore'):
+        w0 = np.where(small, 1 - alpha,
+                      np.sin((1 - alpha) * theta) / sin_theta)
+        w1 = np.where(small, alpha, np.sin(alpha * theta) / sin_theta)
+    q = w0[:, None] * q0 + w1[:, None] * q1
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
+
+
+def interpolate_states(o_states, times, dt=None):
+    """Return the (n,k) states of an object interpolated at the given times.
+
+    Positions (and scales) are interpolated linearly and quaternions with
+    slerp. Times outside the recorded range get the first or last state.
+
+    Parameters
+    ----------
+    o_states : (m,k) array_like
+      Recorded states of the object.
+    times : (n,) array_like
+      Query times.
+    dt : float, optional
+      Timestep at which the states were recorded. If given, the object is
+      held still between states separated by more than dt (see
+      insert_holds).
+
+    """
+    states = np.asarray(o_states, dtype=np.float64)
+    times = np.asarray(times, dtype=np.float64)
+    if dt is not None:
+        states = insert_holds(states, dt)
+    if len(states) == 1:
+        out = np.repeat(states, len(times), axis=0)
+        out[:, 0] = times
+        return out
+    t = states[:, 0]
+    ind = np.clip(np.searchsorted(t, times, side='right') - 1,
+                  0, len(t) - 2)
+    s0 = states[ind]
+    s1 = states[ind + 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        alpha = np.clip((times - s0[:, 0]) / (s1[:, 0] - s0[:, 0]), 0, 1)
+    alpha = np.nan_to_num(alpha)
+    out = s0 + alpha[:, None] * (s1 - s0)
+    out[:, 0] = times
+    out[:, 4:8] = slerp(s0[:, 4:8], s1[:, 4:8], alpha)
+    return out
+
+
+def get_frame_times(states, fps):
+    """Return the times of the frames from 0 to the last recorded time.
+
+    The number of frames is rounded, so that a duration that is a multiple
+    of the frame period is not cut short by floating point error.
+
+    """
+    duration = max((s[-1][0] for s in states.values() if len(s)), default=0)
+    return np.arange(int(round(duration * fps)) + 1) / fps
+
+
+def resample_states(states, fps, dt=None):
+    """Resample the trajectories of a StateObserver at a given frame rate.
+
+    Parameters
+    ----------
+    states : dict
+      Dictionary of o_name: o_states pairs.
+    fps : float
+      Target frame rate.
+    dt : float, optional
+      Timestep at which the states were recorded (see interpolate_states).
+
+    Returns
+    -------
+    resampled : dict
+      Dictionary of o_name: o_states pairs, where o_states is a list of
+      states at every frame from 0 to the last recorded time. Objects with
+      at most one recorded state (i.e. that never moved) are unchanged.
+
+    """
+    times = get_frame_times(states, fps)
+    return {name: (interpolate_states(o_states, times, dt).tolist()
+                   if len(o_states) > 1 else list(o_states))
+            for name, o_states in states.items()}
+
+
+def quats_to_matrices(quats):
+    """Convert (n,4) (w,i,j,k) unit quaternions to (n,3,3) rotations."""
+    w, i, j, k = np.asarray(quats, dtype=np.float64).T
+    rots = np.empty((len(w), 3, 3))
+    rots[:, 0, 0] = 1 - 2*(j*j + k*k)
+    rots[:, 0, 1] = 2*(i*j - k*w)
+    rots[:, 0, 2] = 2*(i*k + j*w)
+    rots[:, 1, 0] = 2*(i*j + k*w)
+    rots[:, 1, 1] = 1 - 2*(i*i + k*k)
+    rots[:, 1, 2] = 2*(j*k - i*w)
+    rots[:, 2, 0] = 2*(i*k - j*w)
+    rots[:, 2, 1] = 2*(j*k + i*w)
+    rots[:, 2, 2] = 1 - 2*(i*i + j*j)
+    return rots
+
+
+def states_to_matrices(states):
+    """Convert (n,k) states to (n,4,4) transforms (column vectors)."""
+    states = np.asarray(states, dtype=np.float64)
+    mats = np.zeros((len(states), 4, 4))
+    mats[:, :3, :3] = quats_to_matrices(states[:, 4:8])
+    if states.shape[1] > 8:
+        mats[:, :3, :3] *= states[:, None, 8:11]
+    mats[:, :3, 3] = states[:, 1:4]
+    mats[:, 3, 3] = 1
+    return mats
+
+
+def get_local_matrices(path, states, times):
+    """Return the (n,4,4) local transforms of a NodePath at the given times.
+
+    The transform is sampled from 'states' if the node is animated, and
+    constant otherwise.
+
+    """
+    try:
+        o_states = states[path.get_name()]
+    except KeyError:
+        o_states = []
+    if len(o_states):
+        return states_to_matrices(sample_states(o_states, times))
+    x, y, z = path.get_pos()
+    w, i, j, k = path.get_quat()
+    sx, sy, sz = path.get_scale()
+    state = np.array([[0, x, y, z, w, i, j, k, sx, sy, sz]])
+    return np.repeat(states_to_matrices(state), len(times), axis=0)
+
+
+def get_world_matrices(path, root, states, times):
+    """Return the (n,4,4) transforms of a NodePath relative to 'root' at the
+    given times, composing the (animated or static) transforms of its
+    ancestors.
+
+    """
+    mats = np.repeat(np.eye(4)[None], len(times), axis=0)
+    while path != root and not path.is_empty():
+        mats = get_local_matrices(path, states, times) @ mats
+        path = path.get_parent()
+    return mats
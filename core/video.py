@@ -0,0 +1,243 @@
+"""
+Video encoding through ffmpeg pipes.
+
+Frames are streamed to a single ffmpeg process as soon as they are available
+(either as raw RGB arrays or as encoded images), so that rendered sequences
+never have to be stored, and optional leading segments (e.g. a countdown)
+are concatenated within the same encode.
+
+Temporal probes (short slowed-down segments used in the behavioral studies)
+are generated from a single decode of the source, with all the variants
+encoded in parallel.
+
+"""
+import json
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from . import config as cfg
+
+
+FFMPEG = "ffmpeg"
+FFPROBE = "ffprobe"
+# Temporal probes: every PROBE_PERIOD seconds, the next PROBE_DURATION
+# seconds are slowed down by a factor PROBE_SLOWDOWN.
+PROBE_PERIOD = .2          # [s]
+PROBE_DURATION = .125      # [s]
+PROBE_SLOWDOWN = 2
+PROBE_NUMBER = 60
+
+
+class VideoEncoder:
+    """Stream raw frames into an ffmpeg process writing a video file.
+
+    Parameters
+    ----------
+    filename : string
+      Output video file.
+    size : (2,) int sequence
+      Width and height of the frames.
+    fps : float, optional
+      Frame rate of the streamed frames (and of the output video).
+    countdown : string, optional
+      Video file prepended to the streamed frames. It is rescaled and
+      resampled to match the output, and encoded in the same pass.
+    crf : int, optional
+      Constant rate factor of the H.264 encoder.
+    pipe_format : {'rawvideo', 'png'}, optional
+      Format of the streamed frames: raw RGB arrays given to write(), or
+      encoded PNG images given to write_encoded().
+
+    """
+    def __init__(self, filename, size, fps=30, countdown=None, crf=25,
+                 pipe_format='rawvideo'):
+        self.filename = filename
+        self.size = tuple(int(s) for s in size)
+        self.fps = fps
+        width, height = self.size
+        cmd = [FFMPEG, '-y', '-loglevel', 'error']
+        if countdown is not None:
+            cmd.extend(['-i', countdown])
+        if pipe_format == 'rawvideo':
+            cmd.extend(['-f', 'rawvideo', '-pix_fmt', 'rgb24',
+                        '-s', '{}x{}'.format(width, height),
+                        '-r', str(fps), '-i', '-'])
+        elif pipe_format == 'png':
+            cmd.extend(['-f', 'image2pipe', '-vcodec', 'png',
+                        '-framerate', str(fps), '-i', '-'])
+        else:
+            raise ValueError("Unknown pipe format: {}".format(pipe_format))
+        if countdown is not None:
+            # Both segments need the same size, rate and pixel format to be
+            # concatenated.
+            graph = (
+                "[0:v]scale={w}:{h},fps={r},setsar=1,format=yuv420p[c];"
+                "[1:v]setsar=1,format=yuv420p[v];"
+                "[c][v]concat=n=2:v=1:a=0[out]"
+            ).format(w=width, h=height, r=fps)
+            cmd.extend(['-filter_complex', graph, '-map', '[out]'])
+        cmd.extend(['-vcodec', 'libx264', '-crf', str(crf),
+                    '-pix_fmt', 'yuv420p', filename])
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        self.n_frames = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, frame):
+        """Write a (height,width,3) uint8 RGB frame."""
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        self._proc.stdin.write(frame.tobytes())
+        self.n_frames += 1
+
+    def write_encoded(self, data):
+        """Write an encoded image (e.g. the bytes of a PNG file)."""
+        self._proc.stdin.write(data)
+        self.n_frames += 1
+
+    def close(self):
+        """Flush the pipe and wait for ffmpeg to finish writing the file."""
+        if self._proc.stdin.closed:
+            return self._proc.returncode
+        self._proc.stdin.close()
+        returncode = self._proc.wait()
+        if returncode:
+            raise RuntimeError(
+                "ffmpeg exited with code {} while writing {}".format(
+                    returncode, self.filename)
+            )
+        return returncode
+
+
+def get_video_info(source):
+    """Return the width, height and frame rate of a video file."""
+    cmd = [FFPROBE, '-v', 'error', '-select_streams', 'v:0',
+           '-show_entries', 'stream=width,height,r_frame_rate',
+           '-of', 'json', source]
+    out = subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout
+    stream = json.loads(out.decode())['streams'][0]
+    num, den = stream['r_frame_rate'].split('/')
+    return stream['width'], stream['height'], int(num) / int(den)
+
+
+def read_frames(source, fps=None, cache=None):
+    """Decode a video or an image sequence once into RGB frames.
+
+    Parameters
+    ----------
+    source : string
+      Video file, or image sequence pattern (e.g. 'frames/%04d.png').
+    fps : float, optional
+      Frame rate of an image sequence. Ignored for video files.
+    cache : string, optional
+      .npy file where the frames are stored (the extension is added if
+      missing). If it already exists, frames are memory-mapped from it
+      instead of being decoded again.
+
+    Returns
+    -------
+    (n,height,width,3) uint8 array
+
+    """
+    if cache is not None:
+        # np.save would add the extension, and the cache would never hit.
+        if cache[-4:] != ".npy":
+            cache += ".npy"
+        if os.path.isfile(cache):
+            return np.load(cache, mmap_mode='r')
+    width, height, _ = get_video_info(source)
+    cmd = [FFMPEG, '-loglevel', 'error']
+    if fps is not None and '%' in source:
+        cmd.extend(['-framerate', str(fps)])
+    cmd.extend(['-i', source, '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-'])
+    out = subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout
+    frames = np.frombuffer(out, np.uint8).reshape(-1, height, width, 3)
+    if cache is not None:
+        np.save(cache, frames)
+    return frames
+
+
+def decode_images(images, size):
+    """Decode a sequence of encoded images (e.g. PNG bytes) into RGB frames.
+
+    Returns
+    -------
+    (n,height,width,3) uint8 array
+
+    """
+    width, height = size
+    cmd = [FFMPEG, '-loglevel', 'error', '-f', 'image2pipe', '-i', '-',
+           '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-']
+    out = subprocess.run(cmd, input=b''.join(images),
+                         stdout=subprocess.PIPE, check=True).stdout
+    return np.frombuffer(out, np.uint8).reshape(-1, height, width, 3)
+
+
+def get_probe_indices(n_frames, fps, start, duration=PROBE_DURATION,
+                      slowdown=PROBE_SLOWDOWN):
+    """Return the frame indices of a video slowed down during a probe.
+
+    Frames displayed during [start, start+duration) are repeated 'slowdown'
+    times, which at a constant frame rate is equivalent to stretching the
+    timestamps of this segment.
+
+    """
+    # Compare frame indices rather than times, which are inexact (e.g.
+    # 3*.2*30 = 18.000000000000004).
+    first = int(np.ceil(round(start * fps, 6)))
+    last = int(np.ceil(round((start + duration) * fps, 6)))
+    repeats = np.ones(n_frames, dtype=int)
+    repeats[first:last] = slowdown
+    return np.repeat(np.arange(n_frames), repeats)
+
+
+def write_temporal_probes(frames, fps, basename, n_probes=PROBE_NUMBER,
+                          period=PROBE_PERIOD, duration=PROBE_DURATION,
+                          slowdown=PROBE_SLOWDOWN, n_jobs=cfg.NCORES,
+                          crf=23):
+    """Encode all the temporal probe variants of a sequence of frames.
+
+    Probe j (starting at 1) starts at j*period and is written to
+    '<basename>_<j>.mp4'. Probes starting after the end of the sequence are
+    skipped.
+
+    Parameters
+    ----------
+    frames : (n,height,width,3) uint8 array
+      Frames of the source video (see read_frames and decode_images).
+    fps : float
+      Frame rate of the source video.
+    basename : string
+      Prefix of the output files.
+    n_jobs : int, optional
+      Number of encodes running in parallel.
+
+    Returns
+    -------
+    filenames : list
+      Names of the written probe videos.
+
+    """
+    n_frames, height, width, _ = frames.shape
+    starts = [j * period for j in range(1, n_probes + 1)]
+    starts = [s for s in starts if s < n_frames / fps]
+    filenames = ["{}_{}.mp4".format(basename, j)
+                 for j in range(1, len(starts) + 1)]
+
+    def encode(filename, start):
+        indices = get_probe_indices(n_frames, fps, start, duration, slowdown)
+        with VideoEncoder(filename, (width, height), fps, crf=crf) as enc:
+            for i in indices:
+                enc.write(frames[i])
+
+    # ffmpeg does the heavy lifting, so threads are enough to keep all the
+    # encoders busy.
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        list(executor.map(encode, filenames, starts))
+    return filenames
@@ -0,0 +1,607 @@
+#!/usr/bin/env python
+"""
+Generate the stimuli of many scenarios and traces as a resumable job graph.
+
+Each (scenario, trace, stage) is a job, where the stages are those of
+demos/generate.py:
+
+    data -> simulate -> export -> import -> render
+                |                      +-> particles
+                +-> annotate
+
+Rendering and encoding are a single stage, since frames are streamed to
+ffmpeg while Blender renders (see blender/render.py).
+
+When a job completes, a stamp with the hashes of its inputs (files and
+parameters) and outputs is written to <scenario_dir>/.stamps/. A job whose
+stamp matches its current inputs and outputs is skipped, so an interrupted
+campaign can be restarted with the same command. Independent jobs run in
+parallel, and the duration of each job is appended to a log file. Traces,
+their parameters, simulation outcomes, files and timings are recorded in a
+SQLite index (see core/index.py).
+
+With --pipeline, traces instead flow through one worker per stage (and
+--blender_jobs render workers), connected by bounded queues: the next traces
+are simulated and imported while the current one renders, and upstream
+stages block when --queue_size traces are waiting for the next stage, which
+caps the number of intermediate files on disk.
+
+Usage
+-----
+python demos/campaign.py collision_falling occlusion_occlusion \
+    --first 0 --ntraces 100 --countdown GreyCountdown.mp4
+
+"""
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import queue
+import sys
+import threading
+import time
+import traceback
+from collections import defaultdict
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                wait)
+
+sys.path.insert(0, os.path.abspath("."))
+import generate  # noqa: E402
+from core import config as cfg  # noqa: E402
+from core.index import StimulusIndex  # noqa: E402
+from core.scenario import GeometryCache  # noqa: E402
+
+STAGES = ('data', 'simulate', 'export', 'import', 'render', 'particles',
+          'annotate')
+# Stages run by Blender are already multithreaded.
+BLENDER_STAGES = ('import', 'render', 'particles')
+STAMP_DIR = ".stamps"
+HASH_CHUNK_SIZE = 1 << 20
+
+
+class Job:
+    """One stage of one trace of a scenario.
+
+    Parameters
+    ----------
+    scenario : string
+      Name of the scenario (file name in the scenarios directory).
+    trace : int
+      Trace number.
+    stage : string
+      One of STAGES.
+    options : dict
+      Campaign options (see get_options).
+
+    """
+    def __init__(self, scenario, trace, stage, options):
+        self.scenario = scenario
+        self.trace = trace
+        self.stage = stage
+        self.options = options
+        self.scenario_dir = os.path.join(options['scenarios'], scenario)
+        self.py_scenario_path = os.path.join(options['scenarios'],
+                                             scenario + '.py')
+
+    @property
+    def key(self):
+        return (self.scenario, self.trace, self.stage)
+
+    def __repr__(self):
+        return "{}/{}:{}".format(*self.key)
+
+    def get_path(self, ext):
+        return generate.get_trace_path(self.scenario_dir, self.trace, ext)
+
+    def get_export_path(self):
+        if self.options['gltf']:
+            return self.get_path('.glb')
+        elif self.options['geom_cache']:
+            return self.get_path('.scene.json')
+        return self.get_path('.egg')
+
+    def get_dependencies(self):
+        stage = self.stage
+        if stage == 'data':
+            return []
+        elif stage == 'simulate':
+            return ['data']
+        elif stage == 'export':
+            # The glTF file contains the animation.
+            return ['data', 'simulate'] if self.options['gltf'] else ['data']
+        elif stage == 'import':
+            return ['simulate', 'export']
+        elif stage == 'annotate':
+            return ['simulate']
+        else:
+            return ['import']
+
+    def get_dependency_keys(self):
+        return [(self.scenario, self.trace, dep)
+                for dep in self.get_dependencies()]
+
+    def get_inputs(self):
+        """Return the input files and the parameters of the job."""
+        opt = self.options
+        stage = self.stage
+        if stage == 'data':
+            return [self.py_scenario_path], {}
+        elif stage == 'simulate':
+            return ([self.py_scenario_path, self.get_path('.gen.json')],
+                    {'contacts': opt['contacts'],
+                     'resample_fps': opt['resample_fps']})
+        elif stage == 'export':
+            files = [self.py_scenario_path, self.get_path('.gen.json')]
+            if opt['gltf']:
+                files.append(self.get_path('.pkl'))
+            return files, {'gltf': opt['gltf'],
+                           'geom_cache': opt['geom_cache']}
+        elif stage == 'import':
+            files = [self.get_path('.pkl'), self.get_export_path()]
+            return files, {'gltf': opt['gltf'],
+                           'geom_cache': opt['geom_cache']}
+        elif stage == 'render':
+            files = [self.get_path('.blend')]
+            if opt['countdown'] is not None:
+                files.append(opt['countdown'])
+            return files, {'probes': opt['probes']}
+        elif stage == 'particles':
+            return [self.get_path('.blend'), self.get_path('.pkl')], {}
+        elif stage == 'annotate':
+            return [self.py_scenario_path, self.get_path('.gen.json'),
+                    self.get_path('.pkl')], {}
+
+    def get_outputs(self):
+        stage = self.stage
+        if stage == 'data':
+            return [self.get_path('.gen.json')]
+        elif stage == 'simulate':
+            if self.options['contacts']:
+                return [self.get_path('.pkl'), self.get_path('.contacts.npz')]
+            return [self.get_path('.pkl')]
+        elif stage == 'export':
+            return [self.get_export_path()]
+        elif stage == 'import':
+            return [self.get_path('.blend')]
+        elif stage == 'render':
+            return [self.get_path('.mp4')]
+        elif stage == 'particles':
+            return [self.get_path('.particles.npz')]
+        elif stage == 'annotate':
+            return [self.get_path('.annotations.npz')]
+
+    def get_stamp_path(self):
+        return os.path.join(self.scenario_dir, STAMP_DIR,
+                            "{}.{}.json".format(self.trace, self.stage))
+
+    def get_input_hash(self):
+        files, params = self.get_inputs()
+        h = hashlib.md5()
+        for path in files:
+            h.update(hash_file(path).encode())
+        h.update(json.dumps(params, sort_keys=True).encode())
+        return h.hexdigest()
+
+    def is_up_to_date(self):
+        try:
+            with open(self.get_stamp_path(), 'r') as f:
+                stamp = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return False
+        if stamp['inputs'] != self.get_input_hash():
+            return False
+        for path, h in stamp['outputs'].items():
+            if not os.path.isfile(path) or hash_file(path) != h:
+                return False
+        return True
+
+    def write_stamp(self):
+        stamp = {'inputs': self.get_input_hash(),
+                 'outputs': {path: hash_file(path)
+                             for path in self.get_outputs()}}
+        path = self.get_stamp_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(stamp, f, indent=2)
+
+    def execute(self):
+        opt = self.options
+        stage = self.stage
+        args = (self.scenario_dir, self.trace)
+        if stage == 'data':
+            generate.create_scene_data(self.py_scenario_path, *args)
+        elif stage == 'simulate':
+            generate.simulate_trace(self.py_scenario_path, *args,
+                                    opt['contacts'], opt['resample_fps'])
+        elif stage == 'export':
+            geom_cache = GeometryCache() if opt['geom_cache'] else None
+            generate.export_trace(self.py_scenario_path, *args, opt['gltf'],
+                                  geom_cache)
+        elif stage == 'import':
+            generate.blender_import_trace(opt['blender'], *args, opt['gltf'],
+                                          opt['geom_cache'])
+        elif stage == 'render':
+            generate.render_trace(opt['blender'], *args, opt['countdown'],
+                                  opt['probes'])
+        elif stage == 'particles':
+            generate.export_trace_particles(opt['blender'], *args)
+        elif stage == 'annotate':
+            generate.annotate_frames(self.py_scenario_path, *args)
+        missing = [path for path in self.get_outputs()
+                   if not os.path.isfile(path)]
+        if missing:
+            raise RuntimeError("Missing outputs: {}".format(missing))
+
+
+def hash_file(path):
+    h = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def run_job(job):
+    """Run a job unless it is up to date.
+
+    Returns
+    -------
+    status : {'done', 'skipped', 'failed'}
+    duration : float
+      Wall-clock time of the job in seconds.
+    error : string or None
+      Traceback of the exception if the job failed.
+
+    """
+    start = time.time()
+    try:
+        if job.is_up_to_date():
+            return 'skipped', time.time() - start, None
+        job.execute()
+        job.write_stamp()
+    except Exception:
+        return 'failed', time.time() - start, traceback.format_exc()
+    return 'done', time.time() - start, None
+
+
+def create_jobs(scenarios, traces, stages, options):
+    """Return the jobs of the campaign, with their dependencies included."""
+    jobs = {}
+    for scenario in scenarios:
+        for trace in traces:
+            todo = list(stages)
+            while todo:
+                job = Job(scenario, trace, todo.pop(), options)
+                if job.key not in jobs:
+                    jobs[job.key] = job
+                    todo.extend(job.get_dependencies())
+    return jobs
+
+
+def get_dependents(jobs):
+    """Return a dict of key: keys of the jobs depending on it."""
+    dependents = {key: [] for key in jobs}
+    for key, job in jobs.items():
+        for dep in job.get_dependency_keys():
+            dependents[dep].append(key)
+    return dependents
+
+
+def index_job(index, job, status, duration):
+    """Record a job and what it produced in a StimulusIndex."""
+    index.add_timing(job.scenario, job.trace, job.stage, status, duration)
+    if status == 'failed':
+        return
+    with open(job.get_stamp_path(), 'r') as f:
+        index.add_files(job.scenario, job.trace, job.stage,
+                        json.load(f)['outputs'])
+    if job.stage == 'data':
+        with open(job.get_path('.gen.json'), 'r') as f:
+            index.add_params(job.scenario, job.trace, json.load(f))
+    elif job.stage == 'simulate':
+        with open(job.get_path('.pkl'), 'rb') as f:
+            metadata = pickle.load(f)['metadata']
+        index.add_simulation(job.scenario, job.trace,
+                             metadata.get('validity'),
+                             metadata.get('success'),
+                             metadata.get('events'))
+
+
+class TimingLog:
+    """Append the timing of each job to a JSON-lines file and keep
+    per-stage totals. Jobs are also recorded in 'index' if given.
+
+    """
+    def __init__(self, filename=None, index=None):
+        self.filename = filename
+        self.index = index
+        self.durations = defaultdict(list)
+        self.counts = defaultdict(lambda: defaultdict(int))
+
+    def add(self, job, status, duration):
+        self.counts[job.stage][status] += 1
+        if status == 'done':
+            self.durations[job.stage].append(duration)
+        if self.filename is not None:
+            entry = {'scenario': job.scenario, 'trace': job.trace,
+                     'stage': job.stage, 'status': status,
+                     'duration': duration, 'time': time.time()}
+            with open(self.filename, 'a') as f:
+                f.write(json.dumps(entry) + "\n")
+        if self.index is not None:
+            index_job(self.index, job, status, duration)
+
+    def summary(self):
+        lines = ["{:<10} {:>6} {:>8} {:>7} {:>10} {:>10}".format(
+            "stage", "done", "skipped", "failed", "total (s)", "mean (s)")]
+        for stage in STAGES:
+            if stage not in self.counts:
+                continue
+            counts = self.counts[stage]
+            durations = self.durations[stage]
+            total = sum(durations)
+            mean = total / len(durations) if durations else 0.
+            lines.append("{:<10} {:>6} {:>8} {:>7} {:>10.1f} {:>10.2f}".format(
+                stage, counts['done'], counts['skipped'], counts['failed'],
+                total, mean))
+        return "\n".join(lines)
+
+
+def run_campaign(jobs, n_jobs=cfg.NCORES, n_blender_jobs=1, log=None):
+    """Run the jobs in parallel, each one as soon as its dependencies are met.
+
+    Parameters
+    ----------
+    jobs : dict
+      Dictionary of key: Job pairs, as returned by create_jobs.
+    n_jobs : int, optional
+      Maximum number of concurrent jobs.
+    n_blender_jobs : int, optional
+      Maximum number of concurrent Blender jobs (import, render, particles).
+    log : TimingLog, optional
+      Log of the job timings.
+
+    Returns
+    -------
+    failed : list
+      Jobs that failed or could not run because a dependency failed.
+
+    """
+    if log is None:
+        log = TimingLog()
+    dependents = get_dependents(jobs)
+    # Number of dependencies of each job that have not finished yet.
+    n_pending = {key: len(job.get_dependencies())
+                 for key, job in jobs.items()}
+    ready = [key for key, n in n_pending.items() if not n]
+    cancelled = set()
+    failed = []
+    running = {}
+    n_blender_running = 0
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        while ready or running:
+            # Submit the jobs whose dependencies are met.
+            for key in list(ready):
+                if len(running) >= n_jobs:
+                    break
+                job = jobs[key]
+                is_blender = job.stage in BLENDER_STAGES
+                if is_blender and n_blender_running >= n_blender_jobs:
+                    continue
+                ready.remove(key)
+                running[executor.submit(run_job, job)] = job
+                n_blender_running += is_blender
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                n_blender_running -= job.stage in BLENDER_STAGES
+                status, duration, error = future.result()
+                log.add(job, status, duration)
+                print("{:<8} {} ({:.1f}s)".format(status, job, duration))
+                if status != 'failed':
+                    for key in dependents[job.key]:
+                        n_pending[key] -= 1
+                        if not n_pending[key] and key not in cancelled:
+                            ready.append(key)
+                    continue
+                print(error)
+                failed.append(job)
+                # Drop the jobs depending on the failed job.
+                todo = list(dependents[job.key])
+                while todo:
+                    key = todo.pop()
+                    if key in cancelled:
+                        continue
+                    cancelled.add(key)
+                    print("Cancelled {} (failed dependency)".format(
+                        jobs[key]))
+                    failed.append(jobs[key])
+                    todo.extend(dependents[key])
+    return failed
+
+
+def run_pipeline(jobs, queue_size=2, n_blender_jobs=1, log=None):
+    """Run the jobs as a pipeline of stages connected by bounded queues.
+
+    Each stage has its own workers (one, or n_blender_jobs for Blender
+    stages), which take traces from the stage's input queue. When a job
+    finishes, its trace is passed to the queue of each dependent stage whose
+    other dependencies are met (e.g. annotate only waits for simulate). A
+    worker blocks when such a queue is full, so at most queue_size traces
+    are waiting for a stage.
+
+    Parameters
+    ----------
+    jobs : dict
+      Dictionary of key: Job pairs, as returned by create_jobs.
+    queue_size : int, optional
+      Capacity of each queue.
+    n_blender_jobs : int, optional
+      Number of workers of each Blender stage (import, render, particles).
+    log : TimingLog, optional
+      Log of the job timings.
+
+    Returns
+    -------
+    failed : list
+      Jobs that failed. The jobs depending on them are not run.
+
+    """
+    if log is None:
+        log = TimingLog()
+    stages = [stage for stage in STAGES
+              if any(key[2] == stage for key in jobs)]
+    n_workers = {stage: n_blender_jobs if stage in BLENDER_STAGES else 1
+                 for stage in stages}
+    queues = {stage: queue.Queue(maxsize=queue_size) for stage in stages}
+    dependents = get_dependents(jobs)
+    # Number of dependencies of each job that have not finished yet.
+    n_pending = {key: len(job.get_dependencies())
+                 for key, job in jobs.items()}
+    failed = []
+    lock = threading.Lock()
+
+    def work(stage, executor):
+        while True:
+            trace = queues[stage].get()
+            if trace is None:
+                return
+            job = jobs[trace + (stage,)]
+            try:
+                status, duration, error = executor.submit(
+                    run_job, job).result()
+            except Exception:
+                status, duration, error = 'failed', 0., traceback.format_exc()
+            ready = []
+            with lock:
+                # A dead worker would block the upstream stages forever on
+                # its queue, so errors of the log only get printed.
+                try:
+                    log.add(job, status, duration)
+                except Exception:
+                    traceback.print_exc()
+                print("{:<8} {} ({:.1f}s)".format(status, job, duration))
+                if status == 'failed':
+                    print(error)
+                    failed.append(job)
+                else:
+                    for key in dependents[job.key]:
+                        n_pending[key] -= 1
+                        if not n_pending[key]:
+                            ready.append(key)
+            for key in ready:
+                # Blocks until the stage has room (back-pressure).
+                queues[key[2]].put(key[:2])
+
+    with ProcessPoolExecutor(max_workers=sum(n_workers.values())) as executor:
+        workers = {stage: [threading.Thread(target=work,
+                                            args=(stage, executor))
+                           for _ in range(n_workers[stage])]
+                   for stage in stages}
+        for stage_workers in workers.values():
+            for worker in stage_workers:
+                worker.start()
+        for key in sorted(key for key, n in n_pending.items() if not n):
+            queues[key[2]].put(key[:2])
+        # Stop the stages in order, once their inputs are exhausted. STAGES
+        # is in dependency order, so all the upstream workers have stopped.
+        for stage in stages:
+            for _ in workers[stage]:
+                queues[stage].put(None)
+            for worker in workers[stage]:
+                worker.join()
+    return failed
+
+
+def get_options(args):
+    return {
+        'scenarios': args.scenarios,
+        'blender': args.blender,
+        'contacts': args.contacts,
+        'resample_fps': args.resample_fps,
+        'gltf': args.gltf,
+        'geom_cache': args.geom_cache,
+        'countdown': args.countdown,
+        'probes': args.probes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Resumable generation of a set of scenarios and traces',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('scenes', type=str, nargs='+',
+                        help='names of the scenes')
+    parser.add_argument('--first', type=int, default=0,
+                        help='first trace number')
+    parser.add_argument('--ntraces', type=int, default=1,
+                        help='number of traces per scene')
+    parser.add_argument('--accepted', action='store_true',
+                        help='run the traces listed in <scenario_dir>/accepted.json (see demos/sample_traces.py) instead')
+    parser.add_argument('--stages', type=str, nargs='+', default=['render'],
+                        choices=STAGES,
+                        help='final stages to run (with their dependencies)')
+    parser.add_argument('--jobs', type=int, default=cfg.NCORES,
+                        help='maximum number of concurrent jobs')
+    parser.add_argument('--blender_jobs', type=int, default=1,
+                        help='maximum number of concurrent Blender jobs')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='run the stages as a pipeline with bounded queues')
+    parser.add_argument('--queue_size', type=int, default=2,
+                        help='maximum number of traces waiting between two stages (with --pipeline)')
+    parser.add_argument('--log', type=str, default='campaign_timings.jsonl',
+                        help='file where the timing of each job is appended')
+    parser.add_argument('--index', type=str, default=cfg.STIMULUS_INDEX,
+                        help='SQLite index of the generated traces')
+    parser.add_argument('--contacts', action='store_true',
+                        help='record the contact onsets and offsets during the simulation')
+    parser.add_argument('--resample_fps', type=int, default=None,
+                        help='resample the trajectories at this frame rate (e.g. {}) instead of keeping the simulation times'.format(cfg.CAMERA_FPS))
+    parser.add_argument('--gltf', action='store_true',
+                        help='export geometry and animation to a single .glb')
+    parser.add_argument('--geom_cache', action='store_true',
+                        help='reuse the cached geometry of each object across traces')
+    parser.add_argument('--blender', type=str, default='/blender/blender',
+                        help='specify blender path')
+    parser.add_argument('--scenarios', type=str, default='scenarios/',
+                        help='specify scenarios path')
+    parser.add_argument('--countdown', type=str, default=None,
+                        help='video prepended to the rendered stimuli')
+    parser.add_argument('--probes', action='store_true',
+                        help='also generate the temporal probes')
+    args = parser.parse_args()
+
+    for scene in args.scenes:
+        os.makedirs(os.path.join(args.scenarios, scene), exist_ok=True)
+    options = get_options(args)
+    if args.accepted:
+        jobs = {}
+        for scene in args.scenes:
+            path = os.path.join(args.scenarios, scene, 'accepted.json')
+            with open(path, 'r') as f:
+                traces = json.load(f)
+            jobs.update(create_jobs([scene], traces, args.stages, options))
+    else:
+        traces = range(args.first, args.first + args.ntraces)
+        jobs = create_jobs(args.scenes, traces, args.stages, options)
+    index = StimulusIndex(args.index)
+    log = TimingLog(args.log, index)
+    start = time.time()
+    if args.pipeline:
+        failed = run_pipeline(jobs, args.queue_size, args.blender_jobs, log)
+    else:
+        failed = run_campaign(jobs, args.jobs, args.blender_jobs, log)
+    index.close()
+    print(log.summary())
+    print("Ran {} jobs in {:.1f}s ({} failed)".format(
+        len(jobs), time.time() - start, len(failed)))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
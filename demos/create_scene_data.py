@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""
+Create the Gen JSON files of many traces of a scenario in one process.
+
+The scenario script is loaded once and each trace is seeded by its number,
+as in demos/generate.py. Existing files are kept.
+
+Usage
+-----
+python demos/create_scene_data.py occlusion_Gen --first 0 --ntraces 1000
+
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath("."))
+from core.scenario import generate_scenario_data  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Batch creation of the Gen JSON files of a scenario',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('scene', type=str,
+                        help='specify name of the scene')
+    parser.add_argument('--first', type=int, default=0,
+                        help='first trace number')
+    parser.add_argument('--ntraces', type=int, default=1,
+                        help='number of traces')
+    parser.add_argument('--scenarios', type=str, default='scenarios/',
+                        help='specify scenarios path')
+    args = parser.parse_args()
+
+    scenario_dir = os.path.join(args.scenarios, args.scene)
+    os.makedirs(scenario_dir, exist_ok=True)
+    traces = range(args.first, args.first + args.ntraces)
+    paths = [os.path.join(scenario_dir, '{}.gen.json'.format(trace))
+             for trace in traces]
+    start = time.time()
+    generate_scenario_data(os.path.join(args.scenarios, args.scene + '.py'),
+                           paths, seeds=traces)
+    duration = time.time() - start
+    print("Created {} traces in {:.2f}s ({:.2f}ms per trace)".format(
+        len(paths), duration, 1000 * duration / max(len(paths), 1)))
+
+
+if __name__ == '__main__':
+    main()
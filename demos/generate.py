@@ -1,13 +1,144 @@
 #!/usr/bin/env python
 
 import os
+import pickle
 import subprocess
 import argparse
-from pathlib import Path
-import json
 
-# loading function from demos/import_scenario.py
-from import_scenario import import_scenario
+import numpy as np
+
+# loading functions from demos/import_scenario.py
+from import_scenario import (FPS, export_scenario, import_scenario_data,
+                             simulate_scenario)
+from core.annotate import annotate_trace
+from core.scenario import GeometryCache
+
+
+# Each stage of the generation of a trace is a function of the scenario
+# script, the scenario directory and the trace number, so that the stages can
+# be run separately (see demos/campaign.py).
+
+
+def get_trace_path(scenario_dir, trace, ext=''):
+    return os.path.join(scenario_dir, '{trace}{ext}'.format(trace=trace, ext=ext))
+
+
+def create_scene_data(py_scenario_path, scenario_dir, trace):
+    """Stage 1: draw the random choices of the trace (<trace>.gen.json).
+
+    The trace number seeds the choices, which are kept if this trace has
+    already been drawn.
+    """
+    gen_json_path = get_trace_path(scenario_dir, trace, '.gen.json')
+    if not os.path.isfile(gen_json_path):
+        print('Creating a random instance of: {}'.format(py_scenario_path))
+    else:
+        print('JSON file already created for this seed number. Skipping the gen step.')
+    return import_scenario_data(py_scenario_path, gen_json_path, seed=trace)
+
+
+def simulate_trace(py_scenario_path, scenario_dir, trace, contacts=False,
+                   resample_fps=None):
+    """Stage 2: simulate the trace (<trace>.pkl, and <trace>.contacts.npz if
+    'contacts' is True).
+
+    If 'resample_fps' is given, the states are resampled at this frame rate.
+    """
+    gen_json_path = get_trace_path(scenario_dir, trace, '.gen.json')
+    scenario_data = import_scenario_data(py_scenario_path, gen_json_path)
+    return simulate_scenario(scenario_data, get_trace_path(scenario_dir, trace),
+                             contacts, resample_fps)
+
+
+def export_trace(py_scenario_path, scenario_dir, trace, gltf=False,
+                 geom_cache=None):
+    """Stage 3: export the scene (<trace>.egg, .scene.json or .glb)."""
+    gen_json_path = get_trace_path(scenario_dir, trace, '.gen.json')
+    scenario_data = import_scenario_data(py_scenario_path, gen_json_path)
+    states = None
+    fps = FPS
+    if gltf:
+        # the animation is baked in the glTF file
+        with open(get_trace_path(scenario_dir, trace, '.pkl'), 'rb') as f:
+            data = pickle.load(f)
+        states = data['states']
+        fps = data['metadata']['fps']
+    export_scenario(scenario_data, get_trace_path(scenario_dir, trace), gltf,
+                    geom_cache, states, fps)
+
+
+def get_blender_cmd(blender, scripts, scenario_dir, trace, blendfile=None,
+                    background=True, options=()):
+    cmd = [blender]
+    if background:
+        cmd.append('--background')
+    if blendfile is not None:
+        cmd.append(blendfile)
+    for script in scripts:
+        cmd.extend(['--python', script])
+    cmd.extend(['--', scenario_dir, str(trace)])
+    cmd.extend(options)
+    return cmd
+
+
+def get_import_scripts(gltf=False):
+    scripts = ['demos/import.py', 'blender/clean_up_scene.py']
+    # the glTF file already contains the animation
+    if not gltf:
+        scripts.append('blender/import_keyframes2.py')
+    return scripts
+
+
+def get_import_options(gltf=False, geom_cache=False):
+    if gltf:
+        return ['--gltf']
+    elif geom_cache:
+        return ['--manifest']
+    return []
+
+
+def blender_import_trace(blender, scenario_dir, trace, gltf=False,
+                         geom_cache=False):
+    """Stage 4: import, clean up and keyframe the scene (<trace>.blend)."""
+    scripts = get_import_scripts(gltf) + ['blender/save.py']
+    cmd = get_blender_cmd(blender, scripts, scenario_dir, trace,
+                          options=get_import_options(gltf, geom_cache))
+    subprocess.run(cmd, check=True)
+
+
+def render_trace(blender, scenario_dir, trace, countdown=None, probes=False):
+    """Stage 5: render and encode the stimulus (<trace>.mp4)."""
+    options = []
+    if countdown is not None:
+        options.extend(['--countdown', countdown])
+    if probes:
+        options.append('--probes')
+    cmd = get_blender_cmd(blender, ['blender/render.py'], scenario_dir, trace,
+                          get_trace_path(scenario_dir, trace, '.blend'),
+                          options=options)
+    subprocess.run(cmd, check=True)
+
+
+def export_trace_particles(blender, scenario_dir, trace):
+    """Optional stage: export the particles (<trace>.particles.npz)."""
+    cmd = get_blender_cmd(blender, ['blender/export_particles.py'],
+                          scenario_dir, trace,
+                          get_trace_path(scenario_dir, trace, '.blend'))
+    subprocess.run(cmd, check=True)
+
+
+def annotate_frames(py_scenario_path, scenario_dir, trace):
+    """Optional stage: 2D boxes and visibility of the objects in each frame,
+    computed from the trajectories (<trace>.annotations.npz).
+    """
+    gen_json_path = get_trace_path(scenario_dir, trace, '.gen.json')
+    scenario_data = import_scenario_data(py_scenario_path, gen_json_path)
+    with open(get_trace_path(scenario_dir, trace, '.pkl'), 'rb') as f:
+        states = pickle.load(f)['states']
+    np.savez_compressed(
+        get_trace_path(scenario_dir, trace, '.annotations.npz'),
+        **annotate_trace(scenario_data, states)
+    )
 
 
 def main():
@@ -27,75 +158,68 @@ def main():
     parser.add_argument('--particles', action='store_true',
                         help='enables particle representation exporting')
 
+    parser.add_argument('--annotate', action='store_true',
+                        help='compute the 2D boxes and visibility of the objects in each frame')
+
+    parser.add_argument('--contacts', action='store_true',
+                        help='record the contact onsets and offsets during the simulation')
+
+    parser.add_argument('--resample_fps', type=int, default = None,
+                        help='resample the trajectories at this frame rate (e.g. the video FPS) instead of keeping the simulation times')
+
+    parser.add_argument('--gltf', action='store_true',
+                        help='export geometry and animation to a single .glb (no egg, no python keyframing)')
+
+    parser.add_argument('--geom_cache', action='store_true',
+                        help='reuse the cached geometry of each object across traces (only transforms are exported)')
+
     parser.add_argument('--blender', type=str, default = '/blender/blender',
                         help='specify blender path')
     parser.add_argument('--scenarios', type=str, default = 'scenarios/',
                         help='specify scenarios path')
+    parser.add_argument('--countdown', type=str, default = None,
+                        help='video prepended to the rendered stimulus (encoded in the same pass)')
+    parser.add_argument('--probes', action='store_true',
+                        help='also generate the temporal probes from the rendered frames')
 
     args = parser.parse_args()
 
-    
+
     # step 1 : create the scene priors file if this
     # seed has never been used before
 
-    # TODO I would suggest writing a python script
-    # with the same random calls that just returns
-    # a dictionary with all of the scene random choices
-    # - there is no need for the data generating procedure
-    # to be in Julia. We can then pass that dictionary to import_scenario
-    # instead of even loading from disk
-    
     # creating directory for gen json if it doesn't exist
     scenario_dir = os.path.join(args.scenarios, args.scene)
     if not os.path.isdir(scenario_dir):
         os.mkdir(scenario_dir)
 
-    gen_json_path = os.path.join(scenario_dir, '{trace}.gen.json'.format(trace=args.trace))
-    if not os.path.isfile(gen_json_path):
-        print('Creating a random instance of: {scene}'.format(scene=args.scene))
-        #cmd = ['julia', 'demos/create_scene_priors.jl', args.scene, str(args.trace), gen_json_path]
-        #subprocess.run(cmd)
-    else:
-        print('JSON file already created for this seed number. Skipping the gen step.')
-
-    
-    # step 2 : creates simu.pkl and scene.egg files
     py_scenario_path = os.path.join(args.scenarios, args.scene+'.py')
-    
-    # notice that a function is loaded from demos/import_scenario.py
-    # (new function based on main in that file)
-    import_scenario(py_scenario_path, gen_json_path, args.debug, scenario_dir, args.trace)
-    
-    blendfile = os.path.join(scenario_dir, '{trace}.blend'.format(trace=args.trace))
-    Path(blendfile).touch()
-    
-    # step 3 : clean up the scene and render in blender
-    eggfile = os.path.join(scenario_dir, '{trace}.egg'.format(trace=args.trace))
+    create_scene_data(py_scenario_path, scenario_dir, args.trace)
 
-    if not args.debug:
-        cmd = [ args.blender, '--background',
-                '--python', 'demos/import.py',
-                '--python', 'blender/clean_up_scene.py',
-                '--python', 'blender/import_keyframes2.py']
+    # step 2 : creates the .pkl and scene files
+    geom_cache = GeometryCache() if args.geom_cache else None
+    simulate_trace(py_scenario_path, scenario_dir, args.trace, args.contacts,
+                   args.resample_fps)
+    export_trace(py_scenario_path, scenario_dir, args.trace, args.gltf,
+                 geom_cache)
+    if args.annotate:
+        annotate_frames(py_scenario_path, scenario_dir, args.trace)
 
+    # step 3 : clean up the scene and render in blender
+    if not args.debug:
+        blender_import_trace(args.blender, scenario_dir, args.trace,
+                             args.gltf, args.geom_cache)
         if args.particles:
-            cmd.extend(['--python', 'blender/export_particles.py'])
+            export_trace_particles(args.blender, scenario_dir, args.trace)
         else:
-            cmd.extend(['--python', 'blender/render.py'])
-
-        cmd.extend(['--', scenario_dir, str(args.trace)])
-
-        subprocess.run(cmd)
+            render_trace(args.blender, scenario_dir, args.trace,
+                         args.countdown, args.probes)
 
     else:
-        cmd = [ args.blender,
-                '--python', 'demos/import.py',
-                '--python', 'blender/clean_up_scene.py',
-                '--python', 'blender/import_keyframes2.py',
-                '--',
-                scenario_dir,
-                str(args.trace)]
-
+        cmd = get_blender_cmd(args.blender, get_import_scripts(args.gltf),
+                              scenario_dir, args.trace, background=False,
+                              options=get_import_options(args.gltf,
+                                                         args.geom_cache))
         subprocess.run(cmd)
 
 if __name__ == '__main__':
@@ -1,4 +1,5 @@
 import bpy
+import json
 import os
 
 bpy.ops.object.delete(use_global=False)
@@ -15,6 +16,31 @@ argv = argv[index:]
 scenario_dir = argv[0]
 trace = argv[1]
 
-fname = '{trace}.egg'.format(trace=trace)
-filepath = os.path.join(scenario_dir, fname)
-bpy.ops.import_scene.egg(filepath=filepath, directory=scenario_dir, files=[{"name":fname, "name":fname}])
+if '--gltf' in argv:
+    # geometry and baked animation in one file
+    fname = '{trace}.glb'.format(trace=trace)
+    filepath = os.path.join(scenario_dir, fname)
+    bpy.ops.import_scene.gltf(filepath=filepath)
+    scene = bpy.context.scene
+    if bpy.data.actions:
+        scene.frame_end = int(max(a.frame_range[1] for a in bpy.data.actions))
+elif '--manifest' in argv:
+    # cached geometry of each object + per-trace transforms
+    fname = '{trace}.scene.json'.format(trace=trace)
+    with open(os.path.join(scenario_dir, fname)) as f:
+        objects = json.load(f)['objects']
+    for obj in objects:
+        directory, name = os.path.split(obj['file'])
+        bpy.ops.import_scene.egg(filepath=obj['file'], directory=directory, files=[{"name":name}])
+    for obj in objects:
+        o = bpy.data.objects[obj['name']]
+        if obj['parent'] is not None:
+            o.parent = bpy.data.objects[obj['parent']]
+        o.rotation_mode = 'QUATERNION'
+        o.location = obj['pos']
+        o.rotation_quaternion = obj['quat']
+        o.scale = obj['scale']
+else:
+    fname = '{trace}.egg'.format(trace=trace)
+    filepath = os.path.join(scenario_dir, fname)
+    bpy.ops.import_scene.egg(filepath=filepath, directory=scenario_dir, files=[{"name":fname, "name":fname}])
@@ -17,14 +17,78 @@ from panda3d.core import load_prc_file_data
 
 #sys.path.insert(0, os.path.abspath(".."))
 sys.path.insert(0, os.path.abspath("."))
-from core.scenario import (StateObserver, import_scenario_data,  # noqa: E402
-                           load_scenario_instance, load_scene)
+from core.scenario import (ContactRecorder, StateObserver,  # noqa: E402
+                           import_scenario_data, load_scenario_instance,
+                           load_scene)
 from gui.viewers import PhysicsViewer, ScenarioViewer, Replayer  # noqa: E402
 
 FPS = 500
 DURATION = 10
 
-def import_scenario(py_scenario_path, gen_json_path, debug, scenario_dir, trace):
+
+def simulate_scenario(scenario_data, scene_path, contacts=False,
+                      resample_fps=None):
+    """Simulate a scenario instance and save its states to <scene_path>.pkl.
+
+    The physical validity and the event labels and times are saved in the
+    metadata. If 'contacts' is True, the contact log is saved to
+    <scene_path>.contacts.npz. If 'resample_fps' is given, the saved states
+    are interpolated at this frame rate instead of keeping the simulation
+    times.
+
+    Returns
+    -------
+    states : dict
+      States recorded by the StateObserver.
+
+    """
+    instance = load_scenario_instance(scenario_data, geom='HD', phys=True)
+    obs = StateObserver(instance.scene)
+    validity = instance.scene.get_physical_validity_constraint()
+    print("Physically valid:", instance.scene.check_physically_valid())
+    callbacks = [obs]
+    if contacts:
+        recorder = ContactRecorder(instance.scene)
+        callbacks.append(recorder)
+    success = instance.simulate(duration=DURATION, timestep=1/FPS,
+                                callbacks=callbacks)
+    if contacts:
+        recorder.export(scene_path + ".contacts.npz")
+    # Event: (label, success_time, failure_time)
+    events = {}
+    graph = instance.embedded_causal_graph
+    if graph is not None:
+        times = graph.get_events_times()
+        events = {name: (label,) + times[name]
+                  for name, label in graph.get_events_labels().items()}
+    obs.export(scene_path + ".pkl", resample_fps, fps=FPS, validity=validity,
+               success=success, events=events)
+    return obs.states
+
+
+def export_scenario(scenario_data, scene_path, gltf=False, geom_cache=None,
+                    states=None, fps=FPS):
+    """Export the scene geometry to be imported in Blender.
+
+    Writes <scene_path>.glb (with the animation baked from 'states',
+    recorded at 'fps') if
+    'gltf' is True, <scene_path>.scene.json if a GeometryCache is given (only
+    transforms are written, geometry is shared across traces), and
+    <scene_path>.egg/.bam otherwise.
+
+    """
+    scene = load_scene(scenario_data['scene'], geom='HD', phys=False,
+                       geom_cache=geom_cache)
+    if gltf:
+        scene.export_scene_to_glb(scene_path, states, fps)
+    elif geom_cache is not None:
+        scene.export_scene_to_manifest(scene_path + ".scene")
+    else:
+        scene.export_scene_to_egg(scene_path)
+
+
+def import_scenario(py_scenario_path, gen_json_path, debug, scenario_dir, trace,
+                    gltf=False, geom_cache=None):
     scenario_data = import_scenario_data(py_scenario_path, gen_json_path)
     scene_data = scenario_data['scene']
 
@@ -43,22 +107,9 @@ def import_scenario(py_scenario_path, gen_json_path, debug, scenario_dir, trace)
             app = PhysicsViewer(world=scene.world)
             scene.graph.reparent_to(app.models)
     else:
-        dir_ = tempfile.mkdtemp()
-        # Create the scene geometry.
-        scene = load_scene(scene_data, geom='HD', phys=False)
-
         scene_path = os.path.join(scenario_dir, str(trace))
-        scene.export_scene_to_egg(scene_path)
-
-        # Run the instance.
-        instance = load_scenario_instance(scenario_data, geom='HD', phys=True)
-        obs = StateObserver(instance.scene)
-        print("Physically valid:", instance.scene.check_physically_valid())
-
-        instance.simulate(duration=DURATION, timestep=1/FPS, callbacks=[obs])
-        # simu_path = os.path.join(dir_, "simu.pkl")
-        simu_path = scene_path + ".pkl"
-        obs.export(simu_path, fps=FPS)
+        states = simulate_scenario(scenario_data, scene_path)
+        export_scenario(scenario_data, scene_path, gltf, geom_cache, states)
         # Show the simulation.
     #     app = Replayer(scene_path+".bam", simu_path)
     # app.cam_distance = 1
@@ -1,25 +1,15 @@
 #!/bin/bash
 
-for j in collision_collision collision_containment collision_falling collision_occlusion collision_topple containment_collision containment_falling containment_occlusion falling_containment falling_occlusion occlusion_collision occlusion_containment occlusion_falling occlusion_occlusion
+# Stages are run in parallel and completed ones are skipped when the campaign
+# is restarted (see demos/campaign.py). Frames are streamed to ffmpeg while
+# rendering, and the countdown is prepended in the same encode.
+python demos/campaign.py collision_collision collision_containment collision_falling collision_occlusion collision_topple containment_collision containment_falling containment_occlusion falling_containment falling_occlusion occlusion_collision occlusion_containment occlusion_falling occlusion_occlusion \
+	--first 208 --ntraces 1 --countdown ../GreyCountdown.mp4
 
+for j in collision_collision collision_containment collision_falling collision_occlusion collision_topple containment_collision containment_falling containment_occlusion falling_containment falling_occlusion occlusion_collision occlusion_containment occlusion_falling occlusion_occlusion
 do
-
 	for i in 208
 	do
-
-		printf "${j}\n0\n" | ./generate.sh
-
-		cd /tmp
-
-		ffmpeg -r 30 -f image2 -s 1920x1080 -i %04d.png -vcodec libx264 -crf 25  -pix_fmt yuv420p $j$i".mp4"
-
-		rm -f *.png
-
-		mkdir -p createFiles/$j$i
-
-		mv $j.egg $j.pkl $j.bam $j.blend createFiles/$j$i
-
-		# rm $j.egg $j.pkl $j.bam $j.blend
-
+		cp scenarios/$j/$i.mp4 $j$i".mp4"
 	done
 done
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Select the traces of a scenario that are physically valid and whose events
+have the requested outcomes, using a fast low-fidelity simulation.
+
+The Gen JSON files of the accepted traces are written, and their numbers are
+saved to <scenario_dir>/accepted.json, from which demos/campaign.py reads
+them with --accepted.
+
+Usage
+-----
+python demos/sample_traces.py occlusion_Gen --ntraces 100 \
+    --causal_graph events.json --outcome ball_falls=1 --outcome hits_wall=0
+python demos/campaign.py occlusion_Gen --accepted --stages render
+
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath("."))
+from core import config as cfg  # noqa: E402
+from core.scenario import generate_scenario_data  # noqa: E402
+from core.tracegen import get_gen_json_path, sample_traces  # noqa: E402
+
+
+def parse_outcome(s):
+    name, label = s.split('=')
+    return name, bool(int(label))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Rejection sampling of the traces of a scenario',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('scene', type=str,
+                        help='specify name of the scene')
+    parser.add_argument('--ntraces', type=int, default=1,
+                        help='number of traces to accept')
+    parser.add_argument('--first', type=int, default=0,
+                        help='first candidate trace number')
+    parser.add_argument('--max_trials', type=int, default=None,
+                        help='maximum number of candidates (default: 100*ntraces)')
+    parser.add_argument('--causal_graph', type=str, default=None,
+                        help='JSON file of the events to attach to the scenario')
+    parser.add_argument('--outcome', type=parse_outcome, action='append',
+                        default=[], help='required outcome of an event, as name={0,1}')
+    parser.add_argument('--success', type=int, default=None,
+                        help='required global outcome of the causal graph (0 or 1)')
+    parser.add_argument('--jobs', type=int, default=cfg.NCORES,
+                        help='number of parallel workers')
+    parser.add_argument('--scenarios', type=str, default='scenarios/',
+                        help='specify scenarios path')
+    args = parser.parse_args()
+
+    causal_graph = None
+    if args.causal_graph is not None:
+        with open(args.causal_graph, 'r') as f:
+            causal_graph = json.load(f)
+    success = None if args.success is None else bool(args.success)
+    py_scenario_path = os.path.join(args.scenarios, args.scene + '.py')
+    scenario_dir = os.path.join(args.scenarios, args.scene)
+    # Existing Gen JSON files are evaluated, since they are kept.
+    accepted, results = sample_traces(
+        py_scenario_path, args.ntraces, dict(args.outcome), success,
+        causal_graph, args.first, args.max_trials, n_jobs=args.jobs,
+        scenario_dir=scenario_dir
+    )
+
+    os.makedirs(scenario_dir, exist_ok=True)
+    paths = [get_gen_json_path(scenario_dir, trace) for trace in accepted]
+    generate_scenario_data(py_scenario_path, paths, seeds=accepted)
+    with open(os.path.join(scenario_dir, 'accepted.json'), 'w') as f:
+        json.dump(accepted, f)
+    print("Accepted traces: {}".format(accepted))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Generate all the temporal probe variants of a stimulus.
+
+The source is decoded once, and every probe (slowed down by half for 125 ms
+every 200 ms) is encoded in parallel from the decoded frames.
+
+Parameters
+----------
+source : string
+  Video file, or image sequence pattern (e.g. /tmp/%04d.png).
+--fps : float, optional
+  Frame rate of an image sequence.
+--cache : string, optional
+  .npy file used to cache the decoded frames.
+--n_probes : int, optional
+  Maximum number of probes.
+
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath("."))
+from core.config import NCORES  # noqa: E402
+from core.video import (PROBE_NUMBER, get_video_info,  # noqa: E402
+                        read_frames, write_temporal_probes)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Temporal probes generation script',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('source', type=str,
+                        help='video file or image sequence pattern')
+    parser.add_argument('--fps', type=float, default=30,
+                        help='frame rate of an image sequence')
+    parser.add_argument('--cache', type=str, default=None,
+                        help='.npy file used to cache the decoded frames')
+    parser.add_argument('--n_probes', type=int, default=PROBE_NUMBER,
+                        help='maximum number of probes')
+    parser.add_argument('--jobs', type=int, default=NCORES,
+                        help='number of parallel encodes')
+    args = parser.parse_args()
+
+    if '%' in args.source:
+        fps = args.fps
+        basename = os.path.dirname(args.source) or '.'
+        basename = os.path.join(basename, 'probe')
+    else:
+        _, _, fps = get_video_info(args.source)
+        basename = os.path.splitext(args.source)[0]
+    frames = read_frames(args.source, fps, args.cache)
+    filenames = write_temporal_probes(frames, fps, basename,
+                                      n_probes=args.n_probes,
+                                      n_jobs=args.jobs)
+    print("Wrote {} probes from {} frames".format(len(filenames),
+                                                  len(frames)))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,11 +6,13 @@ import sys
 import os
 import json
 
-def get_scene_data(gen_json_path):
+def get_scene_data(gen_json_path=None, rng=random):
+    # Random choices are drawn from rng (e.g. random.Random(trace)) so that
+    # traces can be generated concurrently and reproducibly.
     
     # Load or make the random decisions
     
-    if os.path.exists(gen_json_path):
+    if gen_json_path is not None and os.path.exists(gen_json_path):
         
         # Load in the file that contains the generated items
         with open(gen_json_path) as f:
@@ -19,34 +21,35 @@ def get_scene_data(gen_json_path):
     else:
         
         # Make the random decisions in python
-        if random.random() < .5:
+        if rng.random() < .5:
 
             # Make the trace for a ball
             trace = {"is_ball": True,
-                    "ball_radius": random.uniform(0.005,.3),
-                    "force": random.uniform(8,13),
-                    "goblet": {"height": random.uniform(0.05,0.15), 
-                                           "R1": random.uniform(0.01,0.06), 
-                                           "R2": random.uniform(0.01,0.06),
-                                           "EPS": random.uniform(0.001,0.003)},
-                    "ramp": {"height":random.uniform(-0.05,0.05),
-                             "angle": random.uniform(-10,5)}}
+                    "ball_radius": rng.uniform(0.005,.3),
+                    "force": rng.uniform(8,13),
+                    "goblet": {"height": rng.uniform(0.05,0.15), 
+                                           "R1": rng.uniform(0.01,0.06), 
+                                           "R2": rng.uniform(0.01,0.06),
+                                           "EPS": rng.uniform(0.001,0.003)},
+                    "ramp": {"height":rng.uniform(-0.05,0.05),
+                             "angle": rng.uniform(-10,5)}}
 
         else:
             trace = {"is_ball": False,
-                    "plank_lwh": {"length": random.uniform(0.01,0.03), 
-                                           "width": random.uniform(0.01,0.03), 
-                                           "height": random.uniform(0.01,0.03)},
-                    "force": random.uniform(-0.002,-0.01),
-                    "goblet": {"height": random.uniform(0.05,0.15), 
-                                           "R1": random.uniform(0.01,0.06), 
-                                           "R2": random.uniform(0.01,0.06),
-                                           "EPS": random.uniform(0.001,0.003)},
-                    "ramp": {"height":random.uniform(-0.05,0.05),
-                             "angle": random.uniform(-10,5)}}
+                    "plank_lwh": {"length": rng.uniform(0.01,0.03), 
+                                           "width": rng.uniform(0.01,0.03), 
+                                           "height": rng.uniform(0.01,0.03)},
+                    "force": rng.uniform(-0.002,-0.01),
+                    "goblet": {"height": rng.uniform(0.05,0.15), 
+                                           "R1": rng.uniform(0.01,0.06), 
+                                           "R2": rng.uniform(0.01,0.06),
+                                           "EPS": rng.uniform(0.001,0.003)},
+                    "ramp": {"height":rng.uniform(-0.05,0.05),
+                             "angle": rng.uniform(-10,5)}}
         # Save
-        with open(gen_json_path, 'w') as fp:
-            json.dump(trace, fp)                 
+        if gen_json_path is not None:
+            with open(gen_json_path, 'w') as fp:
+                json.dump(trace, fp)                 
             
     # Tell us about it! 
     print(trace)         
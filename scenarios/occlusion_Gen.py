@@ -6,11 +6,13 @@ import sys
 import os
 import json
 
-def get_scene_data(gen_json_path):
+def get_scene_data(gen_json_path=None, rng=random):
+    # Random choices are drawn from rng (e.g. random.Random(trace)) so that
+    # traces can be generated concurrently and reproducibly.
     
     # Load or make the random decisions
     
-    if os.path.exists(gen_json_path):
+    if gen_json_path is not None and os.path.exists(gen_json_path):
         
         # Load in the file that contains the generated items
         with open(gen_json_path) as f:
@@ -18,30 +20,31 @@ def get_scene_data(gen_json_path):
     else:
         
         # Make the random decisions in python
-        if random.random() < .5:
+        if rng.random() < .5:
 
             # Make the trace for a ball
             trace = {"is_ball": True,
-                    "ball_radius": random.uniform(0.005,.3),
-                    "force": random.uniform(8,13),
-                    "occluder_lwh": {"length": random.uniform(0.1,0.4), 
-                                           "width": random.uniform(0.0005,0.0001), 
-                                           "height": random.uniform(0.1,0.6)},
-                    "occluder_pos": random.uniform(0,.3)}
+                    "ball_radius": rng.uniform(0.005,.3),
+                    "force": rng.uniform(8,13),
+                    "occluder_lwh": {"length": rng.uniform(0.1,0.4), 
+                                           "width": rng.uniform(0.0005,0.0001), 
+                                           "height": rng.uniform(0.1,0.6)},
+                    "occluder_pos": rng.uniform(0,.3)}
 
         else:
             trace = {"is_ball": False,
-                    "plank_lwh": {"length": random.uniform(0.01,0.03), 
-                                           "width": random.uniform(0.01,0.03), 
-                                           "height": random.uniform(0.01,0.03)},
-                    "force": random.uniform(0.01,0.04),
-                    "occluder_lwh": {"length": random.uniform(0.1,0.4), 
-                                           "width": random.uniform(0.0005,0.0001), 
-                                           "height": random.uniform(0.1,0.6)},
-                    "occluder_pos": random.uniform(0,.3)}     
+                    "plank_lwh": {"length": rng.uniform(0.01,0.03), 
+                                           "width": rng.uniform(0.01,0.03), 
+                                           "height": rng.uniform(0.01,0.03)},
+                    "force": rng.uniform(0.01,0.04),
+                    "occluder_lwh": {"length": rng.uniform(0.1,0.4), 
+                                           "width": rng.uniform(0.0005,0.0001), 
+                                           "height": rng.uniform(0.1,0.6)},
+                    "occluder_pos": rng.uniform(0,.3)}     
         # Save
-        with open(gen_json_path, 'w') as fp:
-            json.dump(trace, fp)
+        if gen_json_path is not None:
+            with open(gen_json_path, 'w') as fp:
+                json.dump(trace, fp)
 
             
     # Tell us about it! 
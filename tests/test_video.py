@@ -0,0 +1,22 @@
+import numpy as np
+
+from core.video import get_probe_indices
+
+
+def test_probe_start_frame():
+    # 3*.2 = 0.6000000000000001 must still start at frame 18 at 30 FPS.
+    indices = get_probe_indices(60, 30, 3 * .2, duration=.125, slowdown=2)
+    counts = np.bincount(indices)
+    assert counts[17] == 1
+    assert counts[18] == 2
+    # .725 s * 30 = 21.75, so frames 18 to 21 are slowed down.
+    assert np.flatnonzero(counts == 2).tolist() == [18, 19, 20, 21]
+
+
+def test_all_probes_start_on_time():
+    fps = 30
+    for j in range(1, 61):
+        start = j * .2
+        indices = get_probe_indices(400, fps, start)
+        first = np.flatnonzero(np.bincount(indices) == 2)[0]
+        assert first == round(start * fps)